@@ -1,17 +1,36 @@
 import os
+import hmac
 import json
-import pandas as pd
+import base64
+from io import BytesIO
 from datetime import datetime
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
+from flask import Flask, Request, Response, render_template, request, redirect, url_for, flash, jsonify, session, make_response, abort, stream_with_context
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from werkzeug.utils import secure_filename
-from models import db, User, DividendData, DividendTransaction, MonthlyTotal
+from werkzeug.http import is_resource_modified
+from sqlalchemy import select, tuple_
+from sqlalchemy.orm import joinedload
+from models import db, User, Principal, DividendData, DividendTransaction, MonthlyTotal, SymbolTotal, IngestJob, from_cents
 from forms import LoginForm, RegistrationForm, SettingsForm
+from jobs import IngestQueue, QueueFull, RETRY_AFTER
+from summary import get_summary, refresh_progress, clear_summary
+from recovery import update_recovery, projected_recovery, recovery_timeline
+from cache import LRUCache, TTLCache, SharedTTLCache
+from export import export_rows, iter_csv, iter_ndjson
+from metrics import metrics
 from dotenv import load_dotenv
 
 load_dotenv()
 
+class UploadRequest(Request):
+    """Request that keeps uploaded files in memory instead of spooling them to disk"""
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        # Werkzeug fills this from the request body in bounded chunks, and
+        # MAX_CONTENT_LENGTH caps how large it can grow
+        return BytesIO()
+
 app = Flask(__name__)
+app.request_class = UploadRequest
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY')
 
 # app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///dividend_tracker.db')
@@ -23,23 +42,76 @@ if database_url.startswith("postgres://"):
 app.config['SQLALCHEMY_DATABASE_URI'] = database_url
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+# Connections are checked before use and replaced before servers or proxies drop them
+engine_options = {
+    'pool_pre_ping': os.environ.get('DB_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes'),
+    'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800))
+}
+if not database_url.startswith('sqlite'):
+    # Sized for the web server's threads plus the ingest workers
+    engine_options.update({
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 30))
+    })
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options
+app.config['INGEST_WORKERS'] = int(os.environ.get('INGEST_WORKERS', 2))
+app.config['INGEST_JOB_TIMEOUT'] = int(os.environ.get('INGEST_JOB_TIMEOUT', 1800))
+app.config['INGEST_MAX_PENDING'] = int(os.environ.get('INGEST_MAX_PENDING', 8))
+app.config['INGEST_MAX_PENDING_PER_USER'] = int(os.environ.get('INGEST_MAX_PENDING_PER_USER', 2))
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_UPLOAD_MB', 64)) * 1024 * 1024
+app.config['MAX_ARCHIVE_MB'] = int(os.environ.get('MAX_ARCHIVE_MB', 256))
+app.config['PARSE_PROCESSES'] = int(os.environ.get('PARSE_PROCESSES', 0)) or None
+app.config['PAYLOAD_CACHE_SIZE'] = int(os.environ.get('PAYLOAD_CACHE_SIZE', 512))
+app.config['PRINCIPAL_CACHE_SIZE'] = int(os.environ.get('PRINCIPAL_CACHE_SIZE', 1024))
+app.config['PRINCIPAL_CACHE_TTL'] = int(os.environ.get('PRINCIPAL_CACHE_TTL', 300))
+app.config['PRINCIPAL_CACHE_PATH'] = os.environ.get('PRINCIPAL_CACHE_PATH')
+app.config['METRICS_ENABLED'] = os.environ.get('METRICS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+app.config['SERVER_TIMING'] = os.environ.get('SERVER_TIMING', 'false').lower() in ('1', 'true', 'yes')
+
 # Initialize extensions
 db.init_app(app)
+metrics.init_app(app)
+ingest_queue = IngestQueue(app)
+# Serialized API payloads keyed by (dividend data id, version)
+payload_cache = LRUCache(app.config['PAYLOAD_CACHE_SIZE'])
+# Logged-in users and their dividend data id keyed by user id, shared between
+# worker processes when PRINCIPAL_CACHE_PATH names a local file
+if app.config['PRINCIPAL_CACHE_PATH']:
+    principal_cache = SharedTTLCache(app.config['PRINCIPAL_CACHE_PATH'], app.config['PRINCIPAL_CACHE_TTL'])
+else:
+    principal_cache = TTLCache(app.config['PRINCIPAL_CACHE_SIZE'], app.config['PRINCIPAL_CACHE_TTL'])
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
 login_manager.login_message = 'Please log in to access this page.'
 
-@login_manager.user_loader
-def load_user(user_id):
-    return User.query.get(int(user_id))
-
 # Configuration
-UPLOAD_FOLDER = 'uploads'
-ALLOWED_EXTENSIONS = {'csv'}
+ALLOWED_EXTENSIONS = {'csv', 'zip'}
+TRANSACTIONS_PAGE_SIZE = 50
+TRANSACTIONS_MAX_PAGE_SIZE = 500
 
-# Ensure upload directory exists
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+# Endpoints that render from the dashboard summary
+SUMMARY_ENDPOINTS = {'dashboard', 'settings', 'api_monthly_data', 'api_recovery'}
+
+@login_manager.user_loader
+def load_user(user_id):
+    """Load the logged-in user from the principal cache, querying only on a miss"""
+    user_id = int(user_id)
+    principal = principal_cache.get(user_id)
+    if principal is None:
+        row = db.session.execute(
+            select(User.id, User.username, DividendData.id)
+            .outerjoin(DividendData, DividendData.user_id == User.id)
+            .where(User.id == user_id)
+            .order_by(DividendData.id)
+        ).first()
+        if row is None:
+            return None
+        principal = {'id': row[0], 'username': row[1], 'dividend_data_id': row[2]}
+        principal_cache.set(user_id, principal)
+    return Principal(**principal)
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -49,154 +121,71 @@ def get_or_create_user_data():
     if not current_user.is_authenticated:
         return None
     
-    data = DividendData.query.filter_by(user_id=current_user.id).first()
+    data = None
+    if current_user.dividend_data_id:
+        # Pages that render from the summary load it in the same query
+        options = [joinedload(DividendData.summary)] if request.endpoint in SUMMARY_ENDPOINTS else []
+        data = db.session.get(DividendData, current_user.dividend_data_id, options=options)
     if not data:
+        # Users registered before dividend data was created at registration
         data = DividendData(user_id=current_user.id)
         db.session.add(data)
         db.session.commit()
+        principal_cache.delete(current_user.id)
     return data
 
-def parse_robinhood_csv(file_path):
-    """Parse Robinhood CSV and extract dividend transactions"""
-    try:
-        # Read CSV and drop any extra columns beyond the first 9
-        df = pd.read_csv(file_path, on_bad_lines='skip')
-        
-        # If we have more than 9 columns, keep only the first 9
-        if len(df.columns) > 9:
-            df = df.iloc[:, :9]
-        
-        # Updated column names to match actual Robinhood CSV format
-        possible_date_cols = ['Date', 'date', 'Date/Time', 'date/time', 'Activity Date', 'Process Date', 'Settle Date']
-        possible_desc_cols = ['Description', 'description', 'Details', 'details']
-        possible_amount_cols = ['Amount', 'amount', 'Net Amount', 'net amount']
-        possible_instrument_cols = ['Instrument', 'instrument', 'Symbol', 'symbol', 'Security', 'security']
-        
-        # Find the actual column names
-        date_col = next((col for col in possible_date_cols if col in df.columns), None)
-        desc_col = next((col for col in possible_desc_cols if col in df.columns), None)
-        amount_col = next((col for col in possible_amount_cols if col in df.columns), None)
-        instrument_col = next((col for col in possible_instrument_cols if col in df.columns), None)
-        
-        if not all([date_col, desc_col, amount_col]):
-            available_cols = list(df.columns)
-            raise ValueError(f"Could not identify required columns. Available columns: {available_cols}. "
-                           f"Looking for date column (one of {possible_date_cols}), "
-                           f"description column (one of {possible_desc_cols}), "
-                           f"and amount column (one of {possible_amount_cols})")
-        
-        dividend_transactions = []
-        
-        for index, row in df.iterrows():
-            try:
-                description = str(row[desc_col]).lower()
-                amount = row[amount_col]
-                
-                # Look for dividend-related keywords
-                dividend_keywords = ['dividend', 'div', 'distribution']
-                if any(keyword in description for keyword in dividend_keywords):
-                    # Convert amount to float, handling any currency formatting
-                    try:
-                        if isinstance(amount, str):
-                            # Remove currency symbols and commas
-                            amount = amount.replace('$', '').replace(',', '').strip()
-                            amount = float(amount)
-                        else:
-                            amount = float(amount)
-                        
-                        # Only include positive dividend amounts
-                        if amount > 0:
-                            # Create a clean description with symbol and amount
-                            symbol = str(row[instrument_col]) if instrument_col and instrument_col in row else "Unknown"
-                            clean_description = f"{symbol} Dividend - ${amount:.2f}"
-                            
-                            dividend_transactions.append({
-                                'date': str(row[date_col]),
-                                'description': clean_description,
-                                'amount': amount,
-                                'upload_date': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                            })
-                    except (ValueError, TypeError) as e:
-                        # Skip this transaction if amount can't be parsed
-                        continue
-                        
-            except Exception as e:
-                # Skip problematic rows
-                continue
-        
-        return dividend_transactions
-    
-    except Exception as e:
-        raise ValueError(f"Error parsing CSV: {str(e)}")
+def data_version(data):
+    """Version token that changes whenever the user's dividend data changes"""
+    return data.updated_at.strftime('%Y%m%d%H%M%S%f') if data.updated_at else None
+
+def data_etag(data, resource):
+    """ETag for a resource rendered from the user's dividend data"""
+    return f'{resource}-{data.id}-{data_version(data)}'
 
-def update_dividend_totals(data, new_transactions):
-    """Update dividend totals and check for principal recovery"""
-    total_before = data.total_dividends
+def conditional_response(data, etag):
+    """Return a 304 response if the client's cached copy is still current"""
+    if data.updated_at and not is_resource_modified(request.environ, etag=etag, last_modified=data.updated_at):
+        return set_cache_headers(app.response_class(status=304), data, etag)
+    return None
+
+def set_cache_headers(response, data, etag):
+    """Mark a response as revalidated against the user's data version"""
+    if data.updated_at:
+        response.set_etag(etag)
+        response.last_modified = data.updated_at
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+def flash_job_results(data):
+    """Flash the outcome of finished upload jobs and return the ones still active"""
+    pending_jobs = IngestJob.query.filter_by(dividend_data_id=data.id, notified=False) \
+        .order_by(IngestJob.created_at).all()
+    # Jobs abandoned by a worker that died are reported as failed instead of polled forever
+    stale = ingest_queue.fail_stale(pending_jobs)
+    active_jobs = [job for job in pending_jobs if job.status in ('queued', 'running')]
+    finished_jobs = [job for job in pending_jobs if job.status in ('completed', 'failed')]
     
-    for transaction_data in new_transactions:
-        # Parse date with multiple formats
-        date_str = transaction_data['date']
-        date_obj = None
-        
-        date_formats = [
-            '%m/%d/%Y',    # 8/1/2025
-            '%m-%d-%Y',    # 08-01-2025
-            '%Y-%m-%d',    # 2025-08-01
-            '%m/%d/%y',    # 8/1/25
-            '%m-%d-%y'     # 08-01-25
-        ]
-        
-        for fmt in date_formats:
-            try:
-                date_obj = datetime.strptime(date_str, fmt).date()
-                break
-            except ValueError:
-                continue
-        
-        if date_obj is None:
-            continue
-        
-        # Create transaction record
-        transaction = DividendTransaction(
-            dividend_data_id=data.id,
-            date=date_obj,
-            description=transaction_data['description'],
-            amount=transaction_data['amount']
-        )
-        db.session.add(transaction)
-        
-        # Update totals
-        data.total_dividends += transaction_data['amount']
-        
-        # Track monthly totals
-        month_key = date_obj.strftime('%Y-%m')
-        monthly_total = MonthlyTotal.query.filter_by(
-            dividend_data_id=data.id, 
-            month=month_key
-        ).first()
-        
-        if monthly_total:
-            monthly_total.amount += transaction_data['amount']
+    for job in finished_jobs:
+        if job.status == 'failed':
+            flash(f'Error processing file: {job.error}', 'error')
+        elif not job.transactions_found:
+            flash('No dividend transactions found in the uploaded file', 'warning')
         else:
-            monthly_total = MonthlyTotal(
-                dividend_data_id=data.id,
-                month=month_key,
-                amount=transaction_data['amount']
-            )
-            db.session.add(monthly_total)
-    
-    # Check for principal recovery
-    if not data.principal_recovered and data.total_dividends >= data.initial_investment:
-        data.principal_recovered = True
-        data.recovery_date = datetime.utcnow()
-        data.post_recovery_gains = data.total_dividends - data.initial_investment
-    elif data.principal_recovered:
-        data.post_recovery_gains = data.total_dividends - data.initial_investment
-    
-    data.updated_at = datetime.utcnow()
-    db.session.commit()
+            flash(f'Successfully processed {job.inserted} dividend transactions. '
+                  f'Total new dividends: ${job.total_added:.2f}', 'success')
+            if job.duplicates:
+                flash(f'Skipped {job.duplicates} transactions that were already uploaded', 'info')
+            if job.rejected:
+                flash(f'Skipped {job.rejected} transactions with unrecognized dates', 'warning')
+        for file in job.files or []:
+            if file.get('error'):
+                flash(f"Could not process {file['filename']}: {file['error']}", 'error')
+        job.notified = True
     
-    return data.total_dividends - total_before
+    if finished_jobs or stale:
+        db.session.commit()
+    return active_jobs
 
 # Authentication routes
 @app.route('/login', methods=['GET', 'POST'])
@@ -229,6 +218,7 @@ def register():
         # Create new user
         user = User(username=form.username.data)
         user.set_password(form.password.data)
+        user.dividend_data = DividendData()
         db.session.add(user)
         db.session.commit()
         
@@ -240,6 +230,7 @@ def register():
 @app.route('/logout')
 @login_required
 def logout():
+    principal_cache.delete(current_user.id)
     logout_user()
     return redirect(url_for('login'))
 
@@ -249,76 +240,87 @@ def logout():
 def dashboard():
     """Main dashboard showing dividend tracking information"""
     data = get_or_create_user_data()
+    active_jobs = flash_job_results(data)
     
-    # Calculate progress percentage
-    progress_percentage = 0
-    if data.initial_investment > 0:
-        progress_percentage = min(100, (data.total_dividends / data.initial_investment) * 100)
-    
-    # Prepare monthly data for charts
-    monthly_data = []
-    for monthly_total in data.monthly_totals:
-        monthly_data.append({
-            'month': monthly_total.month,
-            'amount': monthly_total.amount
-        })
-    monthly_data.sort(key=lambda x: x['month'])
+    # Pending messages and uploads make the page differ from the cached copy
+    cacheable = not active_jobs and not session.get('_flashes')
+    etag = data_etag(data, 'dashboard')
+    if cacheable:
+        not_modified = conditional_response(data, etag)
+        if not_modified:
+            return not_modified
     
-    return render_template('dashboard.html', 
-                         data=data, 
-                         progress_percentage=progress_percentage,
-                         monthly_data=monthly_data)
+    summary = get_summary(data)
+    response = make_response(render_template('dashboard.html', 
+                                             data=data, 
+                                             summary=summary,
+                                             progress_percentage=summary.progress_percentage,
+                                             monthly_data=[{'month': entry['month'], 'amount': from_cents(entry['amount_cents'])}
+                                                           for entry in summary.monthly_series],
+                                             symbol_totals=[(symbol, from_cents(amount_cents)) for symbol, amount_cents
+                                                            in sorted(summary.symbol_totals.items(), key=lambda item: item[1], reverse=True)],
+                                             projection=projected_recovery(data),
+                                             active_jobs=active_jobs))
+    if cacheable:
+        set_cache_headers(response, data, etag)
+    return response
 
 @app.route('/upload', methods=['GET', 'POST'])
 @login_required
 def upload_file():
-    """Handle CSV file upload and processing"""
+    """Handle upload of one or more CSV files or ZIP archives of them"""
     if request.method == 'POST':
-        if 'file' not in request.files:
+        files = [file for file in request.files.getlist('file') if file.filename]
+        if not files:
             flash('No file selected', 'error')
             return redirect(request.url)
         
-        file = request.files['file']
-        if file.filename == '':
-            flash('No file selected', 'error')
-            return redirect(request.url)
-        
-        if file and allowed_file(file.filename):
-            filename = secure_filename(file.filename)
-            file_path = os.path.join(UPLOAD_FOLDER, filename)
-            file.save(file_path)
-            
+        if all(allowed_file(file.filename) for file in files):
+            # Uploads are parsed from memory on the ingest queue; nothing touches disk.
+            # Detach each buffer so closing the request doesn't close it under the worker.
+            uploads = []
+            for file in files:
+                uploads.append((secure_filename(file.filename), file.stream))
+                file.stream = BytesIO()
+            data = get_or_create_user_data()
             try:
-                # Parse the CSV file
-                new_transactions = parse_robinhood_csv(file_path)
-                
-                if not new_transactions:
-                    flash('No dividend transactions found in the uploaded file', 'warning')
-                    return redirect(url_for('dashboard'))
-                
-                # Load existing data and update
-                data = get_or_create_user_data()
-                new_total = update_dividend_totals(data, new_transactions)
-                
-                flash(f'Successfully processed {len(new_transactions)} dividend transactions. '
-                      f'Total new dividends: ${new_total:.2f}', 'success')
-                
-                # Clean up uploaded file
-                os.remove(file_path)
-                
-                return redirect(url_for('dashboard'))
-                
-            except Exception as e:
-                flash(f'Error processing file: {str(e)}', 'error')
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-                return redirect(request.url)
+                job = ingest_queue.submit(data, uploads)
+            except QueueFull as e:
+                return upload_rejected(str(e), e.status_code)
+            
+            if request.accept_mimetypes.best == 'application/json':
+                return jsonify(job.to_dict()), 202
+            
+            if len(files) > 1:
+                flash(f'{len(files)} files uploaded. Your dividend transactions are being processed.', 'info')
+            else:
+                flash('File uploaded. Your dividend transactions are being processed.', 'info')
+            return redirect(url_for('dashboard'))
         else:
-            flash('Invalid file type. Please upload a CSV file.', 'error')
+            flash('Invalid file type. Please upload CSV files or a ZIP archive of them.', 'error')
             return redirect(request.url)
     
     return render_template('upload.html')
 
+def upload_rejected(message, status_code):
+    """Turn away an upload the ingest queue has no room for, asking the client to retry later"""
+    if request.accept_mimetypes.best == 'application/json':
+        response = make_response(jsonify({'error': message}), status_code)
+    else:
+        flash(message, 'error')
+        response = make_response(render_template('upload.html'), status_code)
+    response.headers['Retry-After'] = str(RETRY_AFTER)
+    return response
+
+@app.errorhandler(413)
+def upload_too_large(e):
+    """Reject uploads larger than MAX_CONTENT_LENGTH"""
+    limit_mb = app.config['MAX_CONTENT_LENGTH'] // (1024 * 1024)
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify({'error': f'File too large. Maximum upload size is {limit_mb} MB.'}), 413
+    flash(f'File too large. Maximum upload size is {limit_mb} MB.', 'error')
+    return redirect(url_for('upload_file'))
+
 @app.route('/settings', methods=['GET', 'POST'])
 @login_required
 def settings():
@@ -329,19 +331,12 @@ def settings():
     if form.validate_on_submit():
         data.initial_investment = form.initial_investment.data
         
-        # Recalculate principal recovery status
-        if data.total_dividends >= form.initial_investment.data:
-            data.principal_recovered = True
-            if not data.recovery_date:
-                data.recovery_date = datetime.utcnow()
-            data.post_recovery_gains = data.total_dividends - form.initial_investment.data
-        else:
-            data.principal_recovered = False
-            data.recovery_date = None
-            data.post_recovery_gains = 0
-        
+        # Recalculate principal recovery status from the cumulative timeline
+        refresh_progress(data)
+        update_recovery(data)
         data.updated_at = datetime.utcnow()
         db.session.commit()
+        principal_cache.delete(current_user.id)
         flash('Initial investment amount updated successfully', 'success')
         return redirect(url_for('dashboard'))
     
@@ -354,8 +349,155 @@ def settings():
 def api_monthly_data():
     """API endpoint for monthly dividend data (for charts)"""
     data = get_or_create_user_data()
-    monthly_totals = {mt.month: mt.amount for mt in data.monthly_totals}
-    return jsonify(monthly_totals)
+    etag = data_etag(data, 'monthly-data')
+    not_modified = conditional_response(data, etag)
+    if not_modified:
+        return not_modified
+    
+    cache_key = (data.id, data_version(data))
+    payload = payload_cache.get(cache_key)
+    if payload is None:
+        monthly_totals = {entry['month']: from_cents(entry['amount_cents']) for entry in get_summary(data).monthly_series}
+        payload = json.dumps(monthly_totals, sort_keys=True, separators=(',', ':'))
+        payload_cache.set(cache_key, payload)
+    
+    response = app.response_class(payload, mimetype='application/json')
+    return set_cache_headers(response, data, etag)
+
+@app.route('/api/recovery')
+@login_required
+def api_recovery():
+    """API endpoint for the principal recovery timeline and projected recovery date"""
+    data = get_or_create_user_data()
+    etag = data_etag(data, 'recovery')
+    not_modified = conditional_response(data, etag)
+    if not_modified:
+        return not_modified
+    
+    get_summary(data)
+    return set_cache_headers(jsonify(recovery_timeline(data)), data, etag)
+
+def encode_cursor(transaction):
+    """Opaque cursor pointing just past a transaction in (date, id) order"""
+    position = f"{transaction.date.strftime('%Y-%m-%d')}:{transaction.id}"
+    return base64.urlsafe_b64encode(position.encode()).decode()
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor, returning the (date, id) position"""
+    date_str, transaction_id = base64.urlsafe_b64decode(cursor.encode()).decode().split(':')
+    return datetime.strptime(date_str, '%Y-%m-%d').date(), int(transaction_id)
+
+@app.route('/api/transactions')
+@login_required
+def api_transactions():
+    """API endpoint for paging through transaction history, newest first
+
+    Query parameters: limit, cursor (from a previous page's next_cursor),
+    start and end (YYYY-MM-DD, inclusive) and symbol.
+    """
+    data = get_or_create_user_data()
+    try:
+        limit = min(int(request.args.get('limit', TRANSACTIONS_PAGE_SIZE)), TRANSACTIONS_MAX_PAGE_SIZE)
+        if limit < 1:
+            raise ValueError('limit must be positive')
+        start = request.args.get('start')
+        end = request.args.get('end')
+        start = datetime.strptime(start, '%Y-%m-%d').date() if start else None
+        end = datetime.strptime(end, '%Y-%m-%d').date() if end else None
+        cursor = request.args.get('cursor')
+        position = decode_cursor(cursor) if cursor else None
+    except (ValueError, TypeError) as e:
+        return jsonify({'error': f'Invalid query parameters: {str(e)}'}), 400
+    
+    # Walks ix_transaction_data_date_id (or the symbol variant) backwards from the cursor
+    query = DividendTransaction.query.filter(DividendTransaction.dividend_data_id == data.id)
+    if start:
+        query = query.filter(DividendTransaction.date >= start)
+    if end:
+        query = query.filter(DividendTransaction.date <= end)
+    symbol = request.args.get('symbol')
+    if symbol:
+        query = query.filter(DividendTransaction.symbol == symbol.upper())
+    if position:
+        query = query.filter(tuple_(DividendTransaction.date, DividendTransaction.id) < position)
+    
+    page = query.order_by(DividendTransaction.date.desc(), DividendTransaction.id.desc()) \
+        .limit(limit + 1).all()
+    has_more = len(page) > limit
+    page = page[:limit]
+    
+    return jsonify({
+        'transactions': [t.to_dict() for t in page],
+        'next_cursor': encode_cursor(page[-1]) if has_more else None
+    })
+
+@app.route('/api/symbols')
+@login_required
+def api_symbols():
+    """API endpoint for dividend income broken down by ticker symbol
+
+    Optional start and end query parameters (YYYY-MM, inclusive) limit the months.
+    """
+    data = get_or_create_user_data()
+    etag = data_etag(data, f"symbols-{request.query_string.decode()}")
+    not_modified = conditional_response(data, etag)
+    if not_modified:
+        return not_modified
+    
+    query = SymbolTotal.query.filter_by(dividend_data_id=data.id)
+    if request.args.get('start'):
+        query = query.filter(SymbolTotal.month >= request.args['start'])
+    if request.args.get('end'):
+        query = query.filter(SymbolTotal.month <= request.args['end'])
+    
+    symbols = {}
+    for symbol_total in query.order_by(SymbolTotal.symbol, SymbolTotal.month):
+        entry = symbols.setdefault(symbol_total.symbol, {'symbol': symbol_total.symbol, 'total': 0, 'monthly': {}})
+        entry['total'] += symbol_total.amount_cents
+        entry['monthly'][symbol_total.month] = symbol_total.amount
+    
+    breakdown = sorted(symbols.values(), key=lambda entry: entry['total'], reverse=True)
+    for entry in breakdown:
+        entry['total'] = from_cents(entry['total'])
+    return set_cache_headers(jsonify(breakdown), data, etag)
+
+@app.route('/api/export.csv')
+@login_required
+def api_export_csv():
+    """Stream all of the user's transactions as CSV in DivTrack's import format"""
+    data = get_or_create_user_data()
+    # The generator reads from an open cursor, so the request context is kept until it finishes
+    response = Response(stream_with_context(iter_csv(export_rows(data.id))), mimetype='text/csv')
+    response.headers['Content-Disposition'] = 'attachment; filename=divtrack-transactions.csv'
+    return response
+
+@app.route('/api/export.ndjson')
+@login_required
+def api_export_ndjson():
+    """Stream all of the user's transactions as newline-delimited JSON"""
+    data = get_or_create_user_data()
+    return Response(stream_with_context(iter_ndjson(export_rows(data.id))), mimetype='application/x-ndjson')
+
+@app.route('/api/jobs/<job_id>')
+@login_required
+def api_job_status(job_id):
+    """API endpoint for the progress of a background upload job"""
+    job = IngestJob.query.filter_by(id=job_id, user_id=current_user.id).first()
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    if ingest_queue.fail_stale([job]):
+        db.session.commit()
+    return jsonify(job.to_dict())
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Request, query and ingest metrics in the Prometheus text format"""
+    if not app.config['METRICS_ENABLED']:
+        abort(404)
+    token = app.config['METRICS_TOKEN']
+    if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        abort(401)
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/reset', methods=['POST'])
 @login_required
@@ -367,6 +509,7 @@ def reset_data():
         # Delete all related data
         DividendTransaction.query.filter_by(dividend_data_id=data.id).delete()
         MonthlyTotal.query.filter_by(dividend_data_id=data.id).delete()
+        SymbolTotal.query.filter_by(dividend_data_id=data.id).delete()
         
         # Reset main data
         data.initial_investment = 0
@@ -375,8 +518,10 @@ def reset_data():
         data.recovery_date = None
         data.post_recovery_gains = 0
         data.updated_at = datetime.utcnow()
+        clear_summary(data)
         
         db.session.commit()
+        principal_cache.delete(current_user.id)
         flash('All data has been reset.', 'success')
     else:
         flash('Reset cancelled', 'info')
@@ -0,0 +1,337 @@
+"""Ingest benchmark: times the upload path on synthetic Robinhood exports
+
+Usage:
+    python bench.py [--rows 1000 10000 ...] [--postgres-url URL] [--output results.json]
+
+Each (backend, size) case runs in a fresh process against an empty database
+and reports seconds, rows/sec, query count, time spent in queries and peak
+RSS for every stage as JSON, followed by the queries and latency of the main
+pages once the data is loaded. Postgres cases run when --postgres-url (or
+BENCH_POSTGRES_URL) is given; that database is dropped and recreated, so
+point it at a scratch database.
+"""
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+import platform
+import subprocess
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import numpy as np
+import pandas as pd
+
+# Row counts of the full suite
+SIZES = [1_000, 10_000, 100_000, 1_000_000, 5_000_000]
+
+# Rows generated and written at a time
+GENERATE_CHUNK = 100_000
+
+HEADER = ['Activity Date', 'Process Date', 'Settle Date', 'Instrument', 'Description',
+          'Trans Code', 'Quantity', 'Price', 'Amount']
+
+SYMBOLS = ['MSTY', 'JEPQ', 'JEPI', 'SCHD', 'QYLD', 'NVDY', 'CONY', 'TSLY', 'ULTY', 'O']
+
+# Activity kinds and their share of rows, roughly matching a busy income account
+ROW_KINDS = ['dividend', 'qualified', 'buy', 'sell', 'deposit', 'interest']
+ROW_WEIGHTS = [0.22, 0.05, 0.33, 0.15, 0.15, 0.10]
+
+# Exports mostly use one date format, with a minority written differently
+DATE_STYLES = ['%m/%d/%Y', '%Y-%m-%d', '%m-%d-%y']
+DATE_WEIGHTS = [0.85, 0.10, 0.05]
+
+# Share of rows that are damaged: cut short, padded with extra fields or holding garbage values
+MALFORMED_RATE = 0.005
+
+# Pages requested once the export is stored, and how many times each
+REQUEST_PATHS = ['/', '/settings', '/api/monthly-data', '/api/recovery', '/api/symbols', '/api/transactions']
+REQUEST_REPEATS = 20
+
+
+def generate_chunk(rng, rows):
+    """Build one chunk of synthetic export rows"""
+    kinds = rng.choice(len(ROW_KINDS), size=rows, p=ROW_WEIGHTS)
+    symbols = np.array(SYMBOLS)[rng.integers(0, len(SYMBOLS), size=rows)]
+    days = pd.Timestamp('2020-01-01') + pd.to_timedelta(rng.integers(0, 6 * 365, size=rows), unit='D')
+    styles = rng.choice(len(DATE_STYLES), size=rows, p=DATE_WEIGHTS)
+    dates = np.select([styles == i for i in range(len(DATE_STYLES))],
+                      [days.strftime(style).to_numpy() for style in DATE_STYLES])
+    quantities = rng.integers(1, 2000, size=rows)
+    prices = rng.uniform(5, 500, size=rows).round(2)
+    rates = rng.uniform(0.01, 2.5, size=rows).round(4)
+
+    output = []
+    for kind, symbol, date, quantity, price, rate in zip(
+        kinds.tolist(), symbols.tolist(), dates.tolist(), quantities.tolist(), prices.tolist(), rates.tolist()
+    ):
+        name = ROW_KINDS[kind]
+        if name == 'dividend':
+            amount = quantity * rate
+            row = [date, date, date, symbol, f"Cash Div: R/D {date} P/D {date} - {quantity} shares at {rate}",
+                   'CDIV', '', '', f"${amount:,.2f}"]
+        elif name == 'qualified':
+            row = [date, date, date, symbol, 'Qualified Dividend', 'QDIV', '', '', f"${quantity * rate:,.2f}"]
+        elif name == 'buy':
+            row = [date, date, date, symbol, f"{symbol} Option Income Strategy ETF", 'Buy',
+                   str(quantity), f"${price:,.2f}", f"(${quantity * price:,.2f})"]
+        elif name == 'sell':
+            row = [date, date, date, symbol, f"{symbol} Option Income Strategy ETF", 'Sell',
+                   str(quantity), f"${price:,.2f}", f"${quantity * price:,.2f}"]
+        elif name == 'deposit':
+            row = [date, date, date, '', 'ACH Deposit', 'ACH', '', '', f"${price * 10:,.2f}"]
+        else:
+            row = [date, date, date, '', 'Interest Payment', 'INT', '', '', f"${rate:,.2f}"]
+        output.append(row)
+
+    for index in np.flatnonzero(rng.random(rows) < MALFORMED_RATE).tolist():
+        damage = rng.integers(0, 4)
+        if damage == 0:
+            output[index] = output[index][:rng.integers(1, len(HEADER))]
+        elif damage == 1:
+            output[index] = output[index] + ['', 'unexpected']
+        elif damage == 2:
+            output[index][0] = 'N/A'
+        else:
+            output[index][-1] = '--'
+    return output
+
+
+def generate_export(path, rows, seed=0):
+    """Write a synthetic Robinhood account history CSV with the given number of rows"""
+    rng = np.random.default_rng(seed)
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(HEADER)
+        for start in range(0, rows, GENERATE_CHUNK):
+            writer.writerows(generate_chunk(rng, min(GENERATE_CHUNK, rows - start)))
+
+
+def reset_peak_rss():
+    """Reset the kernel's peak RSS counter so the next reading covers one stage (Linux only)"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def peak_rss_mb():
+    """Peak resident memory in MB since the last reset, or since process start"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+class QueryCounter:
+    """Counts statements and the time spent executing them on an engine
+
+    Time spent fetching result rows after execution is not included.
+    """
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self.queries = 0
+        self.seconds = 0.0
+        event.listen(engine, 'before_cursor_execute', self._before)
+        event.listen(engine, 'after_cursor_execute', self._after)
+
+    def reset(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+    def _before(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('bench_query_start', []).append(time.perf_counter())
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany):
+        self.queries += 1
+        self.seconds += time.perf_counter() - conn.info['bench_query_start'].pop()
+
+
+@contextmanager
+def measure(stages, name, counter):
+    """Record timing, query and memory figures for one stage; the body sets 'rows'"""
+    stage = {'rows': 0}
+    reset_peak_rss()
+    counter.reset()
+    start = time.perf_counter()
+    yield stage
+    seconds = time.perf_counter() - start
+    stage.update({
+        'seconds': round(seconds, 4),
+        'rows_per_sec': round(stage['rows'] / seconds, 1) if seconds else None,
+        'queries': counter.queries,
+        'query_seconds': round(counter.seconds, 4),
+        'peak_rss_mb': round(peak_rss_mb(), 1)
+    })
+    stages[name] = stage
+
+
+def measure_requests(app, counter):
+    """Average queries and milliseconds per request for each page, logged in as the bench user"""
+    app.config['WTF_CSRF_ENABLED'] = False
+    client = app.test_client()
+    client.post('/login', data={'username': 'bench', 'password': 'bench'})
+
+    pages = {}
+    for path in REQUEST_PATHS:
+        # The first request builds anything cached on demand
+        client.get(path)
+        counter.reset()
+        start = time.perf_counter()
+        for _ in range(REQUEST_REPEATS):
+            response = client.get(path)
+        seconds = time.perf_counter() - start
+        pages[path] = {
+            'status': response.status_code,
+            'queries_per_request': counter.queries / REQUEST_REPEATS,
+            'ms_per_request': round(seconds * 1000 / REQUEST_REPEATS, 2)
+        }
+    return pages
+
+
+def run_case(database_url, csv_path, rows):
+    """Run the upload path for one export against an empty database
+
+    Runs in its own process, since the app reads DATABASE_URL on import and
+    peak memory should not carry over between cases.
+    """
+    os.environ['DATABASE_URL'] = database_url
+    os.environ.setdefault('SECRET_KEY', 'bench')
+    from app import app
+    from models import db, User, DividendData
+    from ingest import parse_broker_csv, update_dividend_totals
+    from summary import rebuild_summary
+
+    stages = {}
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        user = User(username='bench')
+        user.set_password('bench')
+        db.session.add(user)
+        db.session.commit()
+        data = DividendData(user_id=user.id)
+        db.session.add(data)
+        db.session.commit()
+        counter = QueryCounter(db.engine)
+
+        # The same steps an ingest job runs: parse the file, then store it
+        with measure(stages, 'parse', counter) as stage:
+            transactions = parse_broker_csv(csv_path)
+            stage['rows'] = rows
+        with measure(stages, 'save', counter) as stage:
+            result = update_dividend_totals(data, transactions)
+            stage['rows'] = len(transactions)
+
+        # Uploading the same export again exercises duplicate detection
+        with measure(stages, 'reupload', counter) as stage:
+            repeat = update_dividend_totals(data, parse_broker_csv(csv_path))
+            stage['rows'] = rows
+
+        with measure(stages, 'summary', counter) as stage:
+            rebuild_summary(data)
+            db.session.commit()
+            stage['rows'] = result['inserted']
+        db.session.remove()
+
+    # Requests push their own app context, so nothing is left in a shared session between them
+    requests = measure_requests(app, counter)
+
+    with app.app_context():
+        db.drop_all()
+
+    return {
+        'transactions': len(transactions),
+        'inserted': result['inserted'],
+        'rejected': result['rejected'],
+        'duplicates_on_reupload': repeat['duplicates'],
+        'stages': stages,
+        'requests': requests
+    }
+
+
+def git_revision():
+    """Current commit of the checkout, if it is one"""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark CSV ingest on synthetic Robinhood exports')
+    parser.add_argument('--rows', type=int, nargs='+', default=SIZES, help='export sizes to run')
+    parser.add_argument('--postgres-url', default=os.environ.get('BENCH_POSTGRES_URL'),
+                        help='scratch Postgres database to benchmark as well (it is dropped and recreated)')
+    parser.add_argument('--no-sqlite', action='store_true', help='skip the SQLite cases')
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'divtrack-bench'),
+                        help='where generated exports and SQLite databases are kept')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write results to this file instead of stdout')
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    backends = []
+    if not args.no_sqlite:
+        backends.append(('sqlite', 'sqlite:///' + os.path.join(args.data_dir, 'bench.db')))
+    if args.postgres_url:
+        backends.append(('postgresql', args.postgres_url.replace('postgres://', 'postgresql://', 1)))
+
+    import sqlalchemy
+    report = {
+        'meta': {
+            'started_at': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'sqlalchemy': sqlalchemy.__version__,
+            'platform': platform.platform(),
+            'seed': args.seed
+        },
+        'results': []
+    }
+
+    context = multiprocessing.get_context('spawn')
+    for rows in args.rows:
+        csv_path = os.path.join(args.data_dir, f"robinhood_{rows}_{args.seed}.csv")
+        if not os.path.exists(csv_path):
+            print(f"Generating {rows} rows...", file=sys.stderr)
+            generate_export(csv_path, rows, args.seed)
+
+        for backend, database_url in backends:
+            print(f"Running {backend} with {rows} rows...", file=sys.stderr)
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                case = executor.submit(run_case, database_url, csv_path, rows).result()
+            report['results'].append({
+                'backend': backend,
+                'rows': rows,
+                'file_mb': round(os.path.getsize(csv_path) / (1024 * 1024), 2),
+                **case
+            })
+            if backend == 'sqlite':
+                os.remove(database_url[len('sqlite:///'):])
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
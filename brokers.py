@@ -0,0 +1,148 @@
+from collections import namedtuple
+from cache import LRUCache
+
+# Header columns a parser reads; instrument may be None when the export has none, and only
+# DivTrack's own exports carry fingerprints
+ColumnMapping = namedtuple('ColumnMapping', ['date', 'description', 'amount', 'instrument', 'fingerprint'],
+                           defaults=[None])
+
+# Distinct headers whose detected format is remembered
+DETECTION_CACHE_SIZE = 256
+
+
+class BrokerFormat:
+    """Transaction export layout of one broker
+
+    Subclasses declare the columns they read and the header columns that
+    identify their exports. Every column is read as text so each chunk of a
+    file is interpreted the same way, and only the mapped ones are kept.
+    """
+
+    name = None
+    columns = None
+    signature = ()
+    # Generic formats are only tried once every broker-specific one has failed
+    fallback = False
+    # Descriptions are normally rebuilt from the symbol and amount; exports of stored data keep theirs
+    keep_descriptions = False
+
+    def match(self, header):
+        """Return the column mapping if header belongs to this format, else None"""
+        if all(column in header for column in self.signature):
+            return self.columns
+        return None
+
+    def read_options(self, mapping):
+        """dtype argument for pandas.read_csv
+
+        usecols is not passed: with it pandas no longer skips rows that have
+        too many fields, and their values land in the wrong columns.
+        """
+        return {'dtype': str}
+
+    def select(self, chunk, mapping):
+        """Drop the columns a chunk's dividends are not extracted from"""
+        return chunk.drop(columns=[column for column in chunk.columns if column not in mapping])
+
+    def prepare(self, chunk, mapping):
+        """Normalize a chunk of rows before dividends are extracted"""
+        return chunk
+
+
+class DivTrackFormat(BrokerFormat):
+    """Transactions exported by DivTrack itself, so they can be imported elsewhere unchanged"""
+
+    name = 'divtrack'
+    columns = ColumnMapping(date='Date', description='Description', amount='Amount', instrument='Symbol',
+                            fingerprint='Fingerprint')
+    header = ('Date', 'Symbol', 'Description', 'Amount', 'Fingerprint')
+    signature = header
+    keep_descriptions = True
+
+
+class RobinhoodFormat(BrokerFormat):
+    name = 'robinhood'
+    columns = ColumnMapping(date='Activity Date', description='Description', amount='Amount', instrument='Instrument')
+    signature = ('Activity Date', 'Trans Code', 'Instrument', 'Description', 'Amount')
+
+
+class FidelityFormat(BrokerFormat):
+    name = 'fidelity'
+    columns = ColumnMapping(date='Run Date', description='Action', amount='Amount ($)', instrument='Symbol')
+    signature = ('Run Date', 'Action', 'Symbol', 'Amount ($)')
+
+
+class SchwabFormat(BrokerFormat):
+    name = 'schwab'
+    columns = ColumnMapping(date='Date', description='Action', amount='Amount', instrument='Symbol')
+    signature = ('Date', 'Action', 'Symbol', 'Fees & Comm', 'Amount')
+
+    def prepare(self, chunk, mapping):
+        # Adjusted entries are dated "08/01/2025 as of 07/31/2025"; the first date is when it was paid
+        chunk[mapping.date] = chunk[mapping.date].str.split(' as of ', n=1).str[0]
+        return chunk
+
+
+class GenericFormat(BrokerFormat):
+    """Any export with recognizable date, description and amount columns"""
+
+    name = 'generic'
+    fallback = True
+
+    # Only the leading columns are considered; anything past these is ignored
+    max_columns = 9
+
+    date_columns = ['Date', 'date', 'Date/Time', 'date/time', 'Activity Date', 'Process Date', 'Settle Date']
+    description_columns = ['Description', 'description', 'Details', 'details']
+    amount_columns = ['Amount', 'amount', 'Net Amount', 'net amount']
+    instrument_columns = ['Instrument', 'instrument', 'Symbol', 'symbol', 'Security', 'security']
+
+    def match(self, header):
+        header = list(header)[:self.max_columns]
+        mapping = ColumnMapping(
+            date=next((col for col in self.date_columns if col in header), None),
+            description=next((col for col in self.description_columns if col in header), None),
+            amount=next((col for col in self.amount_columns if col in header), None),
+            instrument=next((col for col in self.instrument_columns if col in header), None)
+        )
+        if not all([mapping.date, mapping.description, mapping.amount]):
+            return None
+        return mapping
+
+
+# Formats checked in order, broker-specific ones before fallbacks
+BROKER_FORMATS = [DivTrackFormat(), RobinhoodFormat(), FidelityFormat(), SchwabFormat(), GenericFormat()]
+
+_detected = LRUCache(DETECTION_CACHE_SIZE)
+
+
+def register_format(broker_format):
+    """Add a broker format to the registry; broker-specific formats are tried before any fallback"""
+    position = next((i for i, existing in enumerate(BROKER_FORMATS) if existing.fallback), len(BROKER_FORMATS))
+    if broker_format.fallback:
+        position = len(BROKER_FORMATS)
+    BROKER_FORMATS.insert(position, broker_format)
+    _detected.clear()
+
+
+def detect_format(header):
+    """Pick the broker format and column mapping for a CSV header row
+
+    Results are cached by header, since a user's exports from one broker
+    all share the same header.
+    """
+    header = tuple(header)
+    detected = _detected.get(header)
+    if detected is not None:
+        return detected
+
+    for broker_format in BROKER_FORMATS:
+        mapping = broker_format.match(header)
+        if mapping:
+            _detected.set(header, (broker_format, mapping))
+            return broker_format, mapping
+
+    raise ValueError(f"Could not identify required columns. Available columns: {list(header)}. "
+                     f"Looking for date column (one of {GenericFormat.date_columns}), "
+                     f"description column (one of {GenericFormat.description_columns}), "
+                     f"and amount column (one of {GenericFormat.amount_columns})")
@@ -0,0 +1,106 @@
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Thread-safe least-recently-used cache holding a fixed number of entries"""
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                return default
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class TTLCache(LRUCache):
+    """LRU cache whose entries also expire ttl seconds after they are set"""
+
+    def __init__(self, maxsize=256, ttl=300):
+        super().__init__(maxsize)
+        self.ttl = ttl
+
+    def get(self, key, default=None):
+        entry = super().get(key)
+        if entry is None:
+            return default
+        expires, value = entry
+        if expires < time.monotonic():
+            self.delete(key)
+            return default
+        return value
+
+    def set(self, key, value):
+        super().set(key, (time.monotonic() + self.ttl, value))
+
+
+class SharedTTLCache:
+    """TTL cache kept in a local SQLite file, so every worker process on the host sees the same entries
+
+    Keys are stored as strings and values must be JSON serializable. Each
+    thread opens its own connection on first use.
+    """
+
+    def __init__(self, path, ttl=300):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        connection = sqlite3.connect(path, timeout=5, isolation_level=None)
+        try:
+            # WAL lets readers in other processes carry on while an entry is written
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS cache '
+                               '(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)')
+        finally:
+            connection.close()
+
+    @property
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        return connection
+
+    def get(self, key, default=None):
+        # Wall-clock time, since processes do not share a monotonic clock
+        row = self._connection.execute('SELECT value FROM cache WHERE key = ? AND expires >= ?',
+                                       (str(key), time.time())).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set(self, key, value):
+        now = time.time()
+        self._connection.execute('INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)',
+                                 (str(key), json.dumps(value), now + self.ttl))
+        self._connection.execute('DELETE FROM cache WHERE expires < ?', (now,))
+
+    def delete(self, key):
+        self._connection.execute('DELETE FROM cache WHERE key = ?', (str(key),))
+
+    def clear(self):
+        self._connection.execute('DELETE FROM cache')
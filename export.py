@@ -0,0 +1,79 @@
+import io
+import csv
+import json
+from sqlalchemy import select
+from models import db, DividendTransaction, from_cents
+from brokers import DivTrackFormat
+
+# Rows fetched from the database cursor at a time
+EXPORT_BATCH_SIZE = 5000
+
+# Bytes of CSV or NDJSON collected before a chunk is sent
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+# Written in DivTrack's own import format, so an export can be imported into another database
+EXPORT_HEADER = list(DivTrackFormat.header)
+
+
+def export_rows(dividend_data_id, batch_size=EXPORT_BATCH_SIZE):
+    """Yield a user's transactions as (date, symbol, description, amount_cents, fingerprint) rows
+
+    Rows are streamed from a server-side cursor in batches, so memory stays
+    flat however many transactions the user has.
+    """
+    result = db.session.execute(
+        select(DividendTransaction.date, DividendTransaction.symbol, DividendTransaction.description,
+               DividendTransaction.amount_cents, DividendTransaction.fingerprint)
+        .where(DividendTransaction.dividend_data_id == dividend_data_id)
+        .order_by(DividendTransaction.id)
+        .execution_options(yield_per=batch_size)
+    )
+    yield from result
+
+
+def csv_row(row):
+    """Format an exported row as CSV fields in EXPORT_HEADER order"""
+    date, symbol, description, amount_cents, fingerprint = row
+    return date.isoformat(), symbol, description, f"{from_cents(amount_cents):.2f}", fingerprint
+
+
+def iter_csv(rows, chunk_bytes=EXPORT_CHUNK_BYTES):
+    """Encode exported rows as CSV text, yielding the header at once and then chunks of rows"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_HEADER)
+    yield buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+
+    for row in rows:
+        writer.writerow(csv_row(row))
+        if buffer.tell() >= chunk_bytes:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def iter_ndjson(rows, chunk_bytes=EXPORT_CHUNK_BYTES):
+    """Encode exported rows as newline-delimited JSON objects, yielding chunks of lines
+
+    The first line is yielded on its own so clients start receiving data
+    as soon as the query returns.
+    """
+    lines = []
+    size = 0
+    first = True
+    for date, symbol, description, amount_cents, fingerprint in rows:
+        line = json.dumps({'date': date.isoformat(), 'symbol': symbol, 'description': description,
+                           'amount': from_cents(amount_cents), 'fingerprint': fingerprint}) + '\n'
+        lines.append(line)
+        size += len(line)
+        if first or size >= chunk_bytes:
+            first = False
+            yield ''.join(lines)
+            lines = []
+            size = 0
+    if lines:
+        yield ''.join(lines)
@@ -0,0 +1,546 @@
+import os
+import re
+import time
+import hashlib
+import numpy as np
+import pandas as pd
+from io import StringIO, TextIOBase, TextIOWrapper
+from collections import defaultdict
+from datetime import datetime
+from itertools import islice
+from sqlalchemy import insert, select, update
+from models import db, DividendData, DividendTransaction, MonthlyTotal, SymbolTotal, SYMBOL_LENGTH, amounts_to_cents, from_cents
+from summary import RECENT_TRANSACTIONS, apply_ingest, transaction_entry
+from recovery import update_recovery
+from metrics import metrics
+from brokers import detect_format
+
+# Rows are read in fixed-size chunks so memory stays flat for large exports
+CHUNK_SIZE = 50000
+
+# Symbol recorded for dividends whose instrument is missing
+UNKNOWN_SYMBOL = 'UNKNOWN'
+
+DIVIDEND_KEYWORDS = ['dividend', 'div', 'distribution']
+DIVIDEND_PATTERN = '|'.join(re.escape(keyword) for keyword in DIVIDEND_KEYWORDS)
+
+DATE_FORMATS = [
+    '%m/%d/%Y',    # 8/1/2025
+    '%m-%d-%Y',    # 08-01-2025
+    '%Y-%m-%d',    # 2025-08-01
+    '%m/%d/%y',    # 8/1/25
+    '%m-%d-%y'     # 08-01-25
+]
+
+# Number of values sampled from a file's date column to detect its format
+DATE_SAMPLE_SIZE = 100
+
+# CSV fields as pandas tokenizes them: a quote opens a field only as its first
+# character, "" inside quotes is an escaped quote and text after the closing
+# quote is kept literally. A line that does not match ends inside quotes.
+_QUOTED_REST = r'[^"]*(?:""[^"]*)*"(?:[^",\r\n][^,\r\n]*)?'
+_FIELD = rf'(?:"{_QUOTED_REST}|[^",\r\n][^,\r\n]*|)'
+_LINE_END = rf'(?:,{_FIELD})*[\r\n]*'
+COMPLETE_LINE = re.compile(_FIELD + _LINE_END)
+CLOSING_LINE = re.compile(_QUOTED_REST + _LINE_END)
+
+
+def _to_float(value):
+    """Fallback for amounts pandas cannot coerce but float() accepts"""
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return float('nan')
+
+
+def clean_amounts(amounts):
+    """Strip currency formatting from an amount column and convert it to floats"""
+    cleaned = (amounts.str.replace('$', '', regex=False)
+                      .str.replace(',', '', regex=False)
+                      .str.strip())
+    values = pd.to_numeric(cleaned, errors='coerce').astype('float64')
+
+    # Only rows pandas rejected go through float(), so results match it exactly
+    retry = values.isna() & cleaned.notna()
+    if retry.any():
+        values[retry] = cleaned[retry].map(_to_float)
+    return values
+
+
+def extract_dividends(chunk, columns, upload_date, keep_descriptions=False):
+    """Extract positive dividend transactions from one chunk of rows
+
+    columns is the ColumnMapping detected for the file. Descriptions are
+    rebuilt from the symbol and amount unless keep_descriptions is set.
+    """
+    descriptions = chunk[columns.description].fillna('nan').str.lower()
+    is_dividend = descriptions.str.contains(DIVIDEND_PATTERN, regex=True).to_numpy()
+    if not is_dividend.any():
+        return []
+
+    chunk = chunk[is_dividend]
+    amounts = clean_amounts(chunk[columns.amount])
+    # Non-finite amounts have no representation in cents
+    positive = ((amounts > 0) & np.isfinite(amounts)).to_numpy()
+    if not positive.any():
+        return []
+
+    chunk = chunk[positive]
+    amounts = amounts[positive]
+    cents = amounts_to_cents(amounts)
+    dates = chunk[columns.date].fillna('nan')
+    raw_descriptions = chunk[columns.description].fillna('nan')
+    if columns.instrument:
+        symbols = chunk[columns.instrument].fillna('nan')
+    else:
+        symbols = pd.Series('Unknown', index=chunk.index)
+
+    transactions = [
+        {
+            'date': date,
+            'description': raw_description if keep_descriptions else f"{symbol} Dividend - ${from_cents(amount_cents):.2f}",
+            'amount': amount,
+            'amount_cents': amount_cents,
+            'upload_date': upload_date,
+            'instrument': symbol,
+            'raw_description': raw_description
+        }
+        for date, symbol, amount, amount_cents, raw_description in zip(
+            dates.tolist(), symbols.tolist(), amounts.tolist(), cents.tolist(), raw_descriptions.tolist()
+        )
+    ]
+    if columns.fingerprint:
+        for transaction, fingerprint in zip(transactions, chunk[columns.fingerprint].tolist()):
+            transaction['fingerprint'] = fingerprint
+    return transactions
+
+
+def text_stream(source):
+    """Open a CSV source for reading text with its line endings left as they are"""
+    if isinstance(source, (str, os.PathLike)):
+        return open(source, encoding='utf-8-sig', newline='')
+    if isinstance(source, TextIOBase):
+        return source
+    return TextIOWrapper(source, encoding='utf-8-sig', newline='')
+
+
+def ends_quoted(line, quoted):
+    """Whether a quoted field is still open at the end of a CSV line"""
+    return not (CLOSING_LINE if quoted else COMPLETE_LINE).fullmatch(line)
+
+
+def iter_records(stream):
+    """Yield the records of a CSV text stream
+
+    A line break ends a record only outside a quoted field.
+    """
+    record = []
+    quoted = False
+    for line in stream:
+        record.append(line)
+        if quoted or '"' in line:
+            quoted = ends_quoted(line, quoted)
+        if not quoted:
+            yield record[0] if len(record) == 1 else ''.join(record)
+            record = []
+    if record:
+        yield ''.join(record)
+
+
+def read_header(record):
+    """Parse the column names from a CSV's header record"""
+    return pd.read_csv(StringIO(record), nrows=0).columns
+
+
+def read_block(header_record, records, names, options):
+    """Read a block of records as a frame of the header's columns
+
+    The header record leads the block so pandas checks every data row
+    against it. Its own chunked reader does not: rows with too many fields
+    that start a chunk are kept, cut down to the header's width.
+    """
+    block = pd.read_csv(StringIO(header_record + ''.join(records)), header=None, names=names,
+                        on_bad_lines='skip', **options)
+    return block.iloc[1:]
+
+
+def iter_broker_csv(source, chunksize=CHUNK_SIZE):
+    """Parse a broker's transaction export one chunk at a time
+
+    The broker format is detected from the header row and only the columns
+    it maps are kept from each chunk. source may be a file path or a
+    binary/text file-like object such as an upload stream. Yields the rows
+    read so far and the dividend transactions found in each chunk.
+    """
+    parse_seconds = 0.0
+    stream = text_stream(source)
+    try:
+        start = time.perf_counter()
+        records = iter_records(stream)
+        # Exports often start with blank lines, which pandas skipped before the header
+        header_record = next((record for record in records if record.strip()), '')
+        if not header_record.endswith(('\n', '\r')):
+            header_record += '\n'
+        names = list(read_header(header_record))
+        broker_format, columns = detect_format(names)
+        options = broker_format.read_options(columns)
+        upload_date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+        rows_read = 0
+        while True:
+            block = list(islice(records, chunksize))
+            if not block:
+                break
+            chunk = read_block(header_record, block, names, options)
+            chunk = broker_format.prepare(broker_format.select(chunk, columns), columns)
+            transactions = extract_dividends(chunk, columns, upload_date, broker_format.keep_descriptions)
+            rows_read += len(chunk)
+            # Time spent by the consumer between chunks is not parsing
+            parse_seconds += time.perf_counter() - start
+            yield rows_read, transactions
+            start = time.perf_counter()
+
+    except Exception as e:
+        raise ValueError(f"Error parsing CSV: {str(e)}")
+    finally:
+        if stream is not source:
+            # Files opened from a path are closed; a caller's binary stream is left open for it to close
+            if isinstance(source, (str, os.PathLike)):
+                stream.close()
+            else:
+                stream.detach()
+        metrics.observe('ingest_stage_seconds', parse_seconds, (('stage', 'parse'),))
+
+
+def parse_broker_csv(source, chunksize=CHUNK_SIZE, progress=None):
+    """Parse a broker's transaction export and extract dividend transactions
+
+    If given, progress is called after each chunk with the rows read so far.
+    """
+    dividend_transactions = []
+    for rows_read, transactions in iter_broker_csv(source, chunksize):
+        dividend_transactions.extend(transactions)
+        if progress:
+            progress(rows_read)
+    return dividend_transactions
+
+
+def detect_date_format(dates, sample_size=DATE_SAMPLE_SIZE):
+    """Pick the format that parses the most values in a sample of the date column"""
+    sample = dates.dropna().head(sample_size)
+    best_fmt, best_count = None, 0
+    for fmt in DATE_FORMATS:
+        count = pd.to_datetime(sample, format=fmt, errors='coerce').notna().sum()
+        if count > best_count:
+            best_fmt, best_count = fmt, count
+    return best_fmt
+
+
+def parse_dates(dates):
+    """Parse a column of date strings, returning the parsed dates and how many were rejected"""
+    dates = pd.Series(dates, dtype=object)
+    fmt = detect_date_format(dates)
+    if fmt:
+        parsed = pd.to_datetime(dates, format=fmt, errors='coerce')
+    else:
+        parsed = pd.Series(pd.NaT, index=dates.index, dtype='datetime64[ns]')
+
+    # Only rows the detected format rejected are retried with the other formats
+    for other in DATE_FORMATS:
+        missing = parsed.isna()
+        if not missing.any():
+            break
+        if other != fmt:
+            parsed[missing] = pd.to_datetime(dates[missing], format=other, errors='coerce')
+
+    return parsed, int(parsed.isna().sum())
+
+
+def transaction_keys(frame):
+    """Identify each transaction by its date, instrument, amount and raw description"""
+    return (frame['date'].astype(str) + '|' + frame['instrument'].astype(str) + '|'
+            + frame['amount'].astype(str) + '|' + frame['raw_description'].astype(str))
+
+
+def number_occurrences(frame, keys, seen=None):
+    """Number identical transactions within each file in the frame's source column
+
+    seen carries the counts per key across batches of a single file, so
+    a file imported in several batches is numbered as if read at once.
+    """
+    occurrence = keys.groupby([frame['source'], keys]).cumcount()
+    if seen is not None:
+        occurrence += keys.map(seen).fillna(0).astype('int64')
+        for key, count in keys.value_counts().items():
+            seen[key] = seen.get(key, 0) + count
+    return occurrence
+
+
+def fingerprint_transactions(frame, seen=None):
+    """Hash each transaction's date, instrument, amount and raw description
+
+    Identical rows within one file are numbered so genuine repeats keep
+    distinct fingerprints, while re-uploading the same rows reproduces them.
+    Numbering restarts for each file in the frame's source column, so files
+    with overlapping date ranges produce the same fingerprints for the rows
+    they share.
+    """
+    keys = transaction_keys(frame)
+    occurrence = number_occurrences(frame, keys, seen).astype(str)
+    return [hashlib.sha256(key.encode('utf-8')).hexdigest() for key in (keys + '|' + occurrence).tolist()]
+
+
+def known_fingerprints(dividend_data_id, first_date, last_date):
+    """Load the stored fingerprints for a user within a date range in one query"""
+    return set(db.session.scalars(
+        select(DividendTransaction.fingerprint).where(
+            DividendTransaction.dividend_data_id == dividend_data_id,
+            DividendTransaction.date.between(first_date, last_date),
+            DividendTransaction.fingerprint.isnot(None)
+        )
+    ))
+
+
+def match_legacy_rows(dividend_data_id, frame):
+    """Pair incoming rows with stored rows that predate fingerprints
+
+    Those rows have no fingerprint, but their description was rebuilt from
+    the symbol and amount, so (date, description, amount_cents) identifies
+    them. Each stored row is matched at most once, so genuine repeats stay
+    distinct. Returns a boolean array of the matched rows and the updates
+    that give the stored rows their fingerprints.
+    """
+    matched = np.zeros(len(frame), dtype=bool)
+    legacy = defaultdict(list)
+    for row_id, date, description, amount_cents in db.session.execute(
+        select(DividendTransaction.id, DividendTransaction.date, DividendTransaction.description,
+               DividendTransaction.amount_cents).where(
+            DividendTransaction.dividend_data_id == dividend_data_id,
+            DividendTransaction.date.between(frame['date'].min(), frame['date'].max()),
+            DividendTransaction.fingerprint.is_(None)
+        ).order_by(DividendTransaction.id)
+    ):
+        legacy[(date, description, amount_cents)].append(row_id)
+    if not legacy:
+        return matched, []
+
+    updates = []
+    amounts = pd.to_numeric(frame['amount'], errors='coerce').tolist()
+    for position, (date, description, amount, amount_cents, fingerprint) in enumerate(zip(
+        frame['date'], frame['description'], amounts, frame['amount_cents'].tolist(), frame['fingerprint']
+    )):
+        row_ids = legacy.get((date, description, amount_cents))
+        if not row_ids:
+            # Older rows formatted the float amount, which differs from the cents at half-cent boundaries
+            prefix, separator, _ = description.rpartition(' - $')
+            if separator:
+                row_ids = legacy.get((date, f"{prefix}{separator}{amount:.2f}", amount_cents))
+        if row_ids:
+            updates.append({'id': row_ids.pop(0), 'fingerprint': fingerprint})
+            matched[position] = True
+    return matched, updates
+
+
+def _dialect_insert(dialect):
+    """Return the dialect's INSERT construct if it supports ON CONFLICT"""
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        return None
+    return dialect_insert
+
+
+def upsert_totals(model, dividend_data_id, key_columns, totals):
+    """Add amounts to aggregate rows in a single statement
+
+    totals maps a tuple of key_columns values to the cents to add. The model
+    must have a unique constraint on dividend_data_id plus key_columns.
+    """
+    if not totals:
+        return
+
+    dialect_insert = _dialect_insert(db.session.get_bind().dialect.name)
+    if dialect_insert is None:
+        # No ON CONFLICT support: load the affected rows once and update in place
+        filters = [getattr(model, column).in_({key[i] for key in totals}) for i, column in enumerate(key_columns)]
+        existing = {
+            tuple(getattr(row, column) for column in key_columns): row
+            for row in db.session.scalars(select(model).where(model.dividend_data_id == dividend_data_id, *filters))
+        }
+        for key, amount_cents in totals.items():
+            if key in existing:
+                existing[key].amount_cents += amount_cents
+            else:
+                db.session.add(model(dividend_data_id=dividend_data_id, amount_cents=amount_cents,
+                                     **dict(zip(key_columns, key))))
+        return
+
+    # The statement works on table columns, where cents are stored under 'amount'
+    table = model.__table__
+    stmt = dialect_insert(table).values([
+        {'dividend_data_id': dividend_data_id, 'amount': amount_cents, **dict(zip(key_columns, key))}
+        for key, amount_cents in totals.items()
+    ])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['dividend_data_id', *key_columns],
+        set_={'amount': table.c.amount + stmt.excluded.amount}
+    )
+    db.session.execute(stmt)
+
+
+def upsert_monthly_totals(dividend_data_id, monthly_amounts):
+    """Add cents to each affected month's total (unique_month_per_user)"""
+    upsert_totals(MonthlyTotal, dividend_data_id, ['month'],
+                  {(month,): amount_cents for month, amount_cents in monthly_amounts.items()})
+
+
+def upsert_symbol_totals(dividend_data_id, symbol_amounts):
+    """Add cents to each affected (symbol, month) total (unique_symbol_month_per_user)"""
+    upsert_totals(SymbolTotal, dividend_data_id, ['symbol', 'month'], symbol_amounts)
+
+
+def normalize_symbols(instruments):
+    """Clean instrument values into upper-case ticker symbols, using UNKNOWN when missing"""
+    symbols = instruments.astype(str).str.strip().str.upper().str[:SYMBOL_LENGTH]
+    return symbols.mask(symbols.isin(['', 'NAN', 'NONE', 'UNKNOWN']), UNKNOWN_SYMBOL)
+
+
+def transaction_frame(new_transactions):
+    """Load parsed transactions into a frame, setting aside rows whose date or amount is unusable
+
+    Returns the frame of usable rows with dates converted, their parsed
+    dates and, per source file, how many rows were found and rejected.
+    """
+    frame = pd.DataFrame(new_transactions, columns=['date', 'description', 'amount', 'amount_cents', 'instrument',
+                                                    'raw_description', 'source', 'fingerprint'])
+    frame['source'] = frame['source'].fillna(0).astype('int64')
+    found_by_source = frame['source'].value_counts()
+    dates, _ = parse_dates(frame['date'])
+    amounts = pd.to_numeric(frame['amount'], errors='coerce')
+    valid = dates.notna() & np.isfinite(amounts)
+    rejected_by_source = frame['source'][~valid].value_counts()
+    frame = frame[valid].copy()
+    dates = dates[valid]
+    frame['date'] = dates.dt.date
+
+    # Callers that did not go through the parser only supply dollar amounts
+    missing_cents = frame['amount_cents'].isna()
+    if missing_cents.any():
+        frame.loc[missing_cents, 'amount_cents'] = amounts_to_cents(frame.loc[missing_cents, 'amount'])
+    frame['amount_cents'] = frame['amount_cents'].astype('int64')
+    return frame, dates, found_by_source, rejected_by_source
+
+
+def skip_transactions(new_transactions, seen):
+    """Count transactions a previous run already stored into seen without touching the database
+
+    Used when resuming a batched import so the remaining batches number
+    repeated transactions the same way an uninterrupted run would.
+    """
+    frame = transaction_frame(new_transactions)[0]
+    number_occurrences(frame, transaction_keys(frame), seen)
+
+
+def update_dividend_totals(data, new_transactions, seen=None):
+    """Update dividend totals and check for principal recovery
+
+    Returns a dict with the dividends added, the number of transactions
+    inserted, the number rejected because their date or amount could not be
+    parsed and the number skipped because they were already stored.
+
+    Transactions merged from several files carry the index of their file in
+    'source'; the result then also breaks the counts down per source. When
+    one file is stored in several batches, pass the same seen dict to each.
+    """
+    # The user's row stays locked until the commit below, so uploads running in
+    # other processes are applied one after another. Totals and the summary are
+    # read-modify-write, so they are read only once the lock is held.
+    data = db.session.get(DividendData, data.id, with_for_update=True, populate_existing=True)
+    total_before = data.total_dividends_cents
+
+    frame, dates, found_by_source, rejected_by_source = transaction_frame(new_transactions)
+    rejected = int(rejected_by_source.sum())
+
+    duplicates = 0
+    legacy_updates = []
+    if len(frame):
+        with metrics.timer('ingest_stage_seconds', stage='dedup'):
+            # Exports of stored data bring their original fingerprints along
+            computed = pd.Series(fingerprint_transactions(frame, seen), index=frame.index)
+            frame['fingerprint'] = frame['fingerprint'].fillna(computed)
+
+            # Skip rows stored by an earlier upload with one set-membership check,
+            # and rows repeated across the files of this one
+            known = known_fingerprints(data.id, frame['date'].min(), frame['date'].max())
+            is_new = ~(frame['fingerprint'].isin(known) | frame['fingerprint'].duplicated()).to_numpy()
+
+            # Rows stored before fingerprints existed are matched on their content
+            # instead, and take the fingerprint so later uploads find them directly
+            legacy, legacy_updates = match_legacy_rows(data.id, frame[is_new])
+            is_new[np.flatnonzero(is_new)[legacy]] = False
+            if legacy_updates:
+                db.session.execute(update(DividendTransaction), legacy_updates)
+        duplicates = int((~is_new).sum())
+        frame = frame[is_new]
+        dates = dates[is_new]
+
+    if len(frame):
+        frame['dividend_data_id'] = data.id
+        frame['symbol'] = normalize_symbols(frame['instrument'])
+        with metrics.timer('ingest_stage_seconds', stage='insert'):
+            records = frame[['dividend_data_id', 'date', 'symbol', 'description', 'amount_cents', 'fingerprint']].to_dict('records')
+            db.session.execute(insert(DividendTransaction), records)
+
+        # Group by month and by symbol and month in memory so each is written once.
+        # All sums are exact int64 arithmetic on cents.
+        with metrics.timer('ingest_stage_seconds', stage='aggregate'):
+            cents = frame['amount_cents']
+            months = dates.dt.strftime('%Y-%m')
+            monthly_amounts = cents.groupby(months).sum().to_dict()
+            symbol_amounts = cents.groupby([frame['symbol'], months]).sum().to_dict()
+            upsert_monthly_totals(data.id, monthly_amounts)
+            upsert_symbol_totals(data.id, symbol_amounts)
+        data.total_dividends_cents = (data.total_dividends_cents or 0) + int(cents.sum())
+
+        latest = frame.tail(RECENT_TRANSACTIONS)
+        apply_ingest(data, {
+            'monthly_amounts': monthly_amounts,
+            'symbol_amounts': cents.groupby(frame['symbol']).sum().to_dict(),
+            'inserted': len(frame),
+            'latest': [
+                transaction_entry(date, description, amount_cents)
+                for date, description, amount_cents in zip(latest['date'], latest['description'], latest['amount_cents'].tolist())
+            ]
+        })
+
+        # Check for principal recovery against the updated timeline; backfilled
+        # months can move the recovery date earlier
+        update_recovery(data)
+
+        data.updated_at = datetime.utcnow()
+        with metrics.timer('ingest_stage_seconds', stage='commit'):
+            db.session.commit()
+    else:
+        # Ends the transaction, writing any legacy fingerprints and releasing the lock
+        db.session.commit()
+
+    inserted_by_source = frame['source'].value_counts()
+    sources = {}
+    for source, found in found_by_source.items():
+        source_rejected = int(rejected_by_source.get(source, 0))
+        source_inserted = int(inserted_by_source.get(source, 0))
+        sources[int(source)] = {
+            'inserted': source_inserted,
+            'rejected': source_rejected,
+            'duplicates': int(found) - source_rejected - source_inserted
+        }
+
+    return {
+        'total_added': from_cents(data.total_dividends_cents - total_before),
+        'inserted': len(frame),
+        'rejected': rejected,
+        'duplicates': duplicates,
+        'sources': sources
+    }
@@ -0,0 +1,307 @@
+import os
+import time
+import uuid
+import zipfile
+import threading
+import multiprocessing
+from io import BytesIO
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+from models import db, DividendData, IngestJob
+from ingest import parse_broker_csv, update_dividend_totals
+from metrics import metrics
+
+# Longest filename summary stored on a job
+FILENAME_LENGTH = 255
+
+# Seconds clients are asked to wait before retrying a rejected upload
+RETRY_AFTER = 30
+
+# Error recorded on files whose parse worker process died, e.g. killed for running out of memory
+BROKEN_PARSE_ERROR = 'The parser stopped unexpectedly, possibly because the file is too large'
+
+# Error recorded on jobs whose worker stopped without finishing them
+STALE_JOB_ERROR = 'Processing was interrupted before it finished. Please upload the file again.'
+
+
+def archive_members(archive):
+    """CSV entries of a ZIP archive, skipping directories and macOS resource forks"""
+    return [info for info in archive.infolist()
+            if not info.is_dir() and info.filename.lower().endswith('.csv')
+            and not info.filename.startswith('__MACOSX/')]
+
+
+def expand_archives(files, max_archive_bytes):
+    """Replace ZIP archives in a list of (filename, stream) uploads with the CSVs they contain"""
+    members = []
+    for filename, stream in files:
+        if not filename.lower().endswith('.zip'):
+            members.append((filename, stream))
+            continue
+
+        try:
+            with zipfile.ZipFile(stream) as archive:
+                entries = archive_members(archive)
+                # Sizes come from the archive directory and reads stop at them, so this bounds memory
+                if sum(info.file_size for info in entries) > max_archive_bytes:
+                    raise ValueError(f"{filename} expands to more than {max_archive_bytes // (1024 * 1024)} MB")
+                for info in entries:
+                    members.append((f"{filename}/{info.filename}", BytesIO(archive.read(info))))
+        except zipfile.BadZipFile:
+            raise ValueError(f"{filename} is not a valid ZIP archive")
+
+    if not members:
+        raise ValueError('No CSV files found in the upload')
+    return members
+
+
+class QueueFull(Exception):
+    """Raised when an upload would exceed a pending-job limit; status_code is 429 or 503"""
+
+    def __init__(self, message, status_code):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def parse_member(payload):
+    """Parse one CSV held in memory; runs in a parse worker process
+
+    Returns the transactions, the rows read and the seconds spent parsing.
+    Metrics are not set up in worker processes, so the parent records the time.
+    """
+    rows_read = [0]
+
+    def count_rows(rows):
+        rows_read[0] = rows
+
+    start = time.perf_counter()
+    transactions = parse_broker_csv(BytesIO(payload), progress=count_rows)
+    return transactions, rows_read[0], time.perf_counter() - start
+
+
+class IngestQueue:
+    """Local worker pool that processes uploaded CSV files in the background"""
+
+    def __init__(self, app=None):
+        self.app = None
+        self.executor = None
+        self._parse_pool = None
+        self._parse_pool_lock = threading.Lock()
+        # Uploads for the same user are applied one at a time within this process;
+        # update_dividend_totals locks the user's row against other processes
+        self._user_locks = {}
+        self._user_locks_lock = threading.Lock()
+        # Queued and running jobs of this process, which each hold their upload in memory
+        self._active = set()
+        self._pending = 0
+        self._pending_by_user = defaultdict(int)
+        self._pending_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.executor = ThreadPoolExecutor(max_workers=app.config.get('INGEST_WORKERS', 2),
+                                           thread_name_prefix='ingest')
+
+    @property
+    def parse_pool(self):
+        """Process pool for parsing the files of multi-file uploads, started on first use"""
+        with self._parse_pool_lock:
+            if self._parse_pool is None:
+                # Spawned workers don't inherit the web server's threads or open connections
+                self._parse_pool = ProcessPoolExecutor(
+                    max_workers=self.app.config.get('PARSE_PROCESSES') or min(4, os.cpu_count() or 1),
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+            return self._parse_pool
+
+    def _discard_parse_pool(self, pool):
+        """Shut down a parse pool whose worker died so the next upload starts a new one"""
+        with self._parse_pool_lock:
+            if self._parse_pool is pool:
+                self._parse_pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def _submit_parses(self, members):
+        """Start parsing each member in the parse pool, returning the pool and {future: index}"""
+        def submit_all(pool):
+            return {pool.submit(parse_member, stream.getvalue()): index
+                    for index, (_, stream) in enumerate(members)}
+
+        pool = self.parse_pool
+        try:
+            return pool, submit_all(pool)
+        except BrokenProcessPool:
+            # Broken by another upload since it was started; a fresh pool takes this one
+            self._discard_parse_pool(pool)
+            pool = self.parse_pool
+            return pool, submit_all(pool)
+
+    def fail_stale(self, jobs):
+        """Mark queued or running jobs that outlived INGEST_JOB_TIMEOUT as failed
+
+        Their worker process most likely died, e.g. on a server timeout or
+        restart, and nothing else would ever finish them. Returns whether
+        any job changed; the caller commits.
+        """
+        cutoff = datetime.utcnow() - timedelta(seconds=self.app.config.get('INGEST_JOB_TIMEOUT', 1800))
+        with self._pending_lock:
+            # Jobs this process still holds are alive, however long they take
+            active = set(self._active)
+        stale = [job for job in jobs
+                 if job.status in ('queued', 'running') and job.id not in active
+                 and (job.started_at or job.created_at) < cutoff]
+        for job in stale:
+            job.status = 'failed'
+            job.stage = None
+            job.error = STALE_JOB_ERROR
+            job.finished_at = datetime.utcnow()
+            metrics.inc('ingest_jobs_total', (('status', 'stale'),))
+        return bool(stale)
+
+    def _user_lock(self, user_id):
+        """The lock that serializes a user's jobs in this process"""
+        with self._user_locks_lock:
+            if user_id not in self._user_locks:
+                self._user_locks[user_id] = threading.Lock()
+            return self._user_locks[user_id]
+
+    def _reserve(self, user_id):
+        """Count a new pending job, raising QueueFull if a limit would be exceeded"""
+        with self._pending_lock:
+            if self._pending_by_user[user_id] >= self.app.config.get('INGEST_MAX_PENDING_PER_USER', 2):
+                raise QueueFull('You already have uploads being processed. Please wait for them to finish.', 429)
+            if self._pending >= self.app.config.get('INGEST_MAX_PENDING', 8):
+                raise QueueFull('The server is busy processing other uploads. Please try again shortly.', 503)
+            self._pending += 1
+            self._pending_by_user[user_id] += 1
+
+    def _release(self, user_id):
+        with self._pending_lock:
+            self._pending -= 1
+            self._pending_by_user[user_id] -= 1
+            if not self._pending_by_user[user_id]:
+                del self._pending_by_user[user_id]
+
+    def submit(self, data, files):
+        """Record a queued job for the user's data and hand the uploaded files to a worker
+
+        files is a list of (filename, stream) pairs; each may be a CSV or a
+        ZIP archive of CSVs. Uploads are held in memory until their job
+        finishes, so the number of pending jobs is capped per user and per
+        process; QueueFull is raised when a cap is reached.
+        """
+        self._reserve(data.user_id)
+        job_id = uuid.uuid4().hex
+        with self._pending_lock:
+            self._active.add(job_id)
+        try:
+            summary = ', '.join(filename for filename, _ in files)
+            if len(summary) > FILENAME_LENGTH:
+                summary = f"{len(files)} files"
+            job = IngestJob(id=job_id, user_id=data.user_id, dividend_data_id=data.id,
+                            filename=summary, status='queued')
+            db.session.add(job)
+            db.session.commit()
+            self.executor.submit(self._run, job.id, data.user_id, files)
+        except Exception:
+            with self._pending_lock:
+                self._active.discard(job_id)
+            self._release(data.user_id)
+            raise
+        return job
+
+    def _run(self, job_id, user_id, files):
+        try:
+            with self.app.app_context():
+                job = db.session.get(IngestJob, job_id)
+                if job.status != 'queued':
+                    # Waited so long it was already failed as stale
+                    return
+                try:
+                    with self._user_lock(job.user_id):
+                        self._process(job, files)
+                except Exception as e:
+                    db.session.rollback()
+                    job.status = 'failed'
+                    job.error = str(e)
+                finally:
+                    job.finished_at = datetime.utcnow()
+                    db.session.commit()
+                    metrics.inc('ingest_jobs_total', (('status', job.status),))
+        finally:
+            for _, stream in files:
+                stream.close()
+            with self._pending_lock:
+                self._active.discard(job_id)
+            self._release(user_id)
+
+    def _process(self, job, files):
+        job.status = 'running'
+        job.stage = 'parsing'
+        job.started_at = datetime.utcnow()
+        db.session.commit()
+
+        members = expand_archives(files, self.app.config.get('MAX_ARCHIVE_MB', 256) * 1024 * 1024)
+        stats = [{'filename': filename, 'rows_read': 0} for filename, _ in members]
+        parsed = [[] for _ in members]
+
+        if len(members) == 1:
+            def report_progress(rows_read):
+                job.rows_read = rows_read
+                db.session.commit()
+
+            # A lone file is parsed on this thread so progress is reported per chunk
+            parsed[0] = parse_broker_csv(members[0][1], progress=report_progress)
+            stats[0]['rows_read'] = job.rows_read
+        else:
+            pool, futures = self._submit_parses(members)
+            broken = False
+            for future in as_completed(futures):
+                index = futures[future]
+                try:
+                    parsed[index], stats[index]['rows_read'], parse_seconds = future.result()
+                    metrics.observe('ingest_stage_seconds', parse_seconds, (('stage', 'parse'),))
+                except BrokenProcessPool:
+                    # Only files still being parsed when the worker died are lost
+                    broken = True
+                    stats[index]['error'] = BROKEN_PARSE_ERROR
+                except Exception as e:
+                    stats[index]['error'] = str(e)
+                job.rows_read = sum(stat['rows_read'] for stat in stats)
+                db.session.commit()
+            if broken:
+                self._discard_parse_pool(pool)
+
+            failed = [stat for stat in stats if 'error' in stat]
+            if len(failed) == len(stats):
+                raise ValueError('; '.join(f"{stat['filename']}: {stat['error']}" for stat in failed))
+
+        # Merged in upload order and tagged with their file, so rows repeated across files are stored once
+        new_transactions = []
+        for index, transactions in enumerate(parsed):
+            stats[index]['transactions_found'] = len(transactions)
+            for transaction in transactions:
+                transaction['source'] = index
+            new_transactions.extend(transactions)
+
+        job.transactions_found = len(new_transactions)
+        job.files = stats
+        job.stage = 'saving'
+        db.session.commit()
+
+        if new_transactions:
+            data = db.session.get(DividendData, job.dividend_data_id)
+            result = update_dividend_totals(data, new_transactions)
+            job.inserted = result['inserted']
+            job.duplicates = result['duplicates']
+            job.rejected = result['rejected']
+            job.total_added = result['total_added']
+            # JSON columns only detect reassignment, so the per-file stats are rebuilt
+            job.files = [{**stat, **result['sources'].get(index, {})} for index, stat in enumerate(stats)]
+
+        job.status = 'completed'
+        job.stage = None
@@ -1,5 +1,32 @@
 from app import app, db
+from models import User, DividendData, DividendTransaction, SymbolTotal, DashboardSummary, Cents, SYMBOL_LENGTH, CENT_PRECISION
+from ingest import UNKNOWN_SYMBOL, iter_broker_csv, skip_transactions, update_dividend_totals
+from export import EXPORT_HEADER, export_rows, csv_row
+from jobs import archive_members
+from collections import defaultdict
+from sqlalchemy import inspect, text, select, update, delete, func, Integer
+import os
 import sys
+import csv
+import json
+import time
+import zipfile
+import argparse
+
+# Indexes superseded by ones the models now declare, dropped by migrate where they remain
+OBSOLETE_INDEXES = {
+    # Covered by ix_ingest_job_data_notified_created
+    'ingest_job': ['ix_ingest_job_dividend_data_id'],
+}
+
+# Rows updated per statement when backfilling existing data
+BACKFILL_BATCH_SIZE = 5000
+
+# CSV rows stored per commit by the import command
+IMPORT_BATCH_ROWS = 50000
+
+# Exported rows between progress messages
+EXPORT_PROGRESS_ROWS = 100000
 
 def reset_db():
     with app.app_context():
@@ -11,7 +38,255 @@ def reset_db():
             print(f"Error resetting database: {e}")
             sys.exit(1)
 
+def migrate():
+    """Add tables, columns and indexes introduced since the database was created, dropping superseded indexes"""
+    with app.app_context():
+        try:
+            db.create_all()
+            inspector = inspect(db.engine)
+            preparer = db.engine.dialect.identifier_preparer
+            with db.engine.begin() as conn:
+                for table in db.metadata.sorted_tables:
+                    existing_columns = {col['name'] for col in inspector.get_columns(table.name)}
+                    for column in table.columns:
+                        if column.name not in existing_columns:
+                            column_type = column.type.compile(dialect=db.engine.dialect)
+                            conn.execute(text(f"ALTER TABLE {preparer.quote(table.name)} "
+                                              f"ADD COLUMN {preparer.quote(column.name)} {column_type}"))
+                            print(f"Added column {table.name}.{column.name}")
+
+                    existing_indexes = {idx['name'] for idx in inspector.get_indexes(table.name)}
+                    for index in table.indexes:
+                        if index.name not in existing_indexes:
+                            index.create(conn)
+                            print(f"Created index {index.name}")
+                    for index_name in OBSOLETE_INDEXES.get(table.name, []):
+                        if index_name in existing_indexes:
+                            conn.execute(text(f"DROP INDEX {preparer.quote(index_name)}"))
+                            print(f"Dropped index {index_name}")
+                
+                convert_money_columns(conn, inspector)
+            backfill_symbols()
+            print("Database migrated successfully")
+        except Exception as e:
+            print(f"Error migrating database: {e}")
+            sys.exit(1)
+
+def convert_money_columns(conn, inspector):
+    """Convert money columns still stored as Float into integer cents in place
+
+    Only columns whose database type is not yet an integer are touched, so
+    running this again is a no-op.
+    """
+    preparer = conn.dialect.identifier_preparer
+    converted = False
+    for table in db.metadata.sorted_tables:
+        existing_types = {col['name']: col['type'] for col in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if not isinstance(column.type, Cents) or isinstance(existing_types.get(column.name), Integer):
+                continue
+            
+            table_name = preparer.quote(table.name)
+            column_name = preparer.quote(column.name)
+            # Both round half away from zero on the decimal value, like models.amounts_to_cents
+            if conn.dialect.name == 'postgresql':
+                conn.execute(text(f"ALTER TABLE {table_name} ALTER COLUMN {column_name} "
+                                  f"TYPE BIGINT USING ROUND({column_name}::NUMERIC * 100)::BIGINT"))
+            else:
+                # SQLite cannot change a column's type, so swap in a new column
+                temp_name = preparer.quote(f"{column.name}_cents")
+                constraint = "" if column.nullable else " NOT NULL DEFAULT 0"
+                conn.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {temp_name} BIGINT{constraint}"))
+                conn.execute(text(f"UPDATE {table_name} SET {temp_name} = "
+                                  f"CAST(ROUND(ROUND({column_name} * 100, {CENT_PRECISION})) AS INTEGER)"))
+                conn.execute(text(f"ALTER TABLE {table_name} DROP COLUMN {column_name}"))
+                conn.execute(text(f"ALTER TABLE {table_name} RENAME COLUMN {temp_name} TO {column_name}"))
+            print(f"Converted {table.name}.{column.name} to cents")
+            converted = True
+    
+    if converted:
+        # Summaries hold dollar amounts from before the conversion; they are rebuilt on demand
+        conn.execute(delete(DashboardSummary.__table__))
+
+def backfill_symbols():
+    """Fill in symbols for transactions stored before the column existed and rebuild their totals"""
+    affected = set()
+    updated = 0
+    while True:
+        # Each batch is updated before the next is read, so no cursor stays open across writes
+        batch = db.session.execute(
+            select(DividendTransaction.id, DividendTransaction.dividend_data_id, DividendTransaction.description)
+            .where(DividendTransaction.symbol.is_(None))
+            .limit(BACKFILL_BATCH_SIZE)
+        ).all()
+        if not batch:
+            break
+        
+        rows = []
+        for transaction_id, dividend_data_id, description in batch:
+            # Descriptions were stored as "<symbol> Dividend - $<amount>"
+            symbol = description.split(' Dividend - ')[0].strip().upper()
+            if symbol in ('', 'NAN', 'UNKNOWN'):
+                symbol = UNKNOWN_SYMBOL
+            rows.append({'id': transaction_id, 'symbol': symbol[:SYMBOL_LENGTH]})
+            affected.add(dividend_data_id)
+        db.session.execute(update(DividendTransaction), rows)
+        updated += len(rows)
+    
+    for dividend_data_id in affected:
+        db.session.execute(delete(SymbolTotal).where(SymbolTotal.dividend_data_id == dividend_data_id))
+        totals = defaultdict(int)
+        daily = db.session.execute(
+            select(DividendTransaction.symbol, DividendTransaction.date, func.sum(DividendTransaction.amount_cents))
+            .where(DividendTransaction.dividend_data_id == dividend_data_id)
+            .group_by(DividendTransaction.symbol, DividendTransaction.date)
+        )
+        for symbol, date, amount_cents in daily:
+            totals[(symbol, date.strftime('%Y-%m'))] += amount_cents
+        db.session.add_all([
+            SymbolTotal(dividend_data_id=dividend_data_id, symbol=symbol, month=month, amount_cents=amount_cents)
+            for (symbol, month), amount_cents in totals.items()
+        ])
+    
+    db.session.commit()
+    if updated:
+        print(f"Backfilled symbols for {updated} transactions across {len(affected)} users")
+
+def find_user_data(username):
+    """Look up a user's dividend data by username, exiting if there is no such user"""
+    user = User.query.filter_by(username=username).first()
+    if not user:
+        print(f"No user named {username}", file=sys.stderr)
+        sys.exit(1)
+    
+    data = DividendData.query.filter_by(user_id=user.id).first()
+    if not data:
+        data = DividendData(user_id=user.id)
+        db.session.add(data)
+        db.session.commit()
+    return data
+
+def import_sources(paths):
+    """Yield (name, source, checkpoint key) for each CSV, opening the members of ZIP archives in turn"""
+    for path in paths:
+        stat = os.stat(path)
+        # A file that changed since the checkpoint was written starts over
+        stamp = f"{stat.st_size}:{int(stat.st_mtime)}"
+        if path.lower().endswith('.zip'):
+            with zipfile.ZipFile(path) as archive:
+                for info in archive_members(archive):
+                    name = f"{path}/{info.filename}"
+                    with archive.open(info) as member:
+                        yield name, member, f"{os.path.abspath(path)}/{info.filename}:{stamp}"
+        else:
+            yield path, path, f"{os.path.abspath(path)}:{stamp}"
+
+def load_checkpoint(path, username):
+    """Read the rows already imported per file, ignoring checkpoints for other users"""
+    if os.path.exists(path):
+        with open(path) as f:
+            checkpoint = json.load(f)
+        if checkpoint.get('user') == username:
+            return checkpoint
+    return {'user': username, 'files': {}}
+
+def save_checkpoint(path, checkpoint):
+    # Written to a temporary file first so an interrupted write never leaves a corrupt checkpoint
+    with open(path + '.tmp', 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(path + '.tmp', path)
+
+def import_files(username, paths, batch_rows=IMPORT_BATCH_ROWS, checkpoint_path=None):
+    """Import CSV files or ZIP archives into a user's data, committing every batch_rows rows
+
+    Progress is saved to a checkpoint after each commit. Running the same
+    command again after an interruption skips the work already committed,
+    and transactions that were stored anyway are caught as duplicates.
+    """
+    checkpoint_path = checkpoint_path or f".divtrack-import-{username}.json"
+    with app.app_context():
+        data = find_user_data(username)
+        checkpoint = load_checkpoint(checkpoint_path, username)
+        totals = defaultdict(int)
+        try:
+            for name, source, key in import_sources(paths):
+                state = checkpoint['files'].setdefault(key, {'rows': 0, 'done': False})
+                if state['done']:
+                    print(f"{name}: already imported, skipping", file=sys.stderr)
+                    continue
+                
+                # Occurrence counts of repeated transactions carry over between the file's batches
+                seen = {}
+                start = time.time()
+                for rows_read, transactions in iter_broker_csv(source, chunksize=batch_rows):
+                    if rows_read <= state['rows']:
+                        # Committed by an earlier run; only the occurrence counts are rebuilt
+                        if transactions:
+                            skip_transactions(transactions, seen)
+                        continue
+                    
+                    if transactions:
+                        result = update_dividend_totals(data, transactions, seen)
+                        for field in ('inserted', 'duplicates', 'rejected'):
+                            totals[field] += result[field]
+                    state['rows'] = rows_read
+                    save_checkpoint(checkpoint_path, checkpoint)
+                    rate = rows_read / max(time.time() - start, 1e-6)
+                    print(f"{name}: {rows_read:,} rows read, {totals['inserted']:,} inserted, "
+                          f"{totals['duplicates']:,} duplicates ({rate:,.0f} rows/s)", file=sys.stderr)
+                
+                state['done'] = True
+                save_checkpoint(checkpoint_path, checkpoint)
+        except Exception as e:
+            db.session.rollback()
+            print(f"Import stopped: {e}. Run the same command again to resume.", file=sys.stderr)
+            sys.exit(1)
+        
+        os.remove(checkpoint_path)
+        print(f"Imported {totals['inserted']} transactions "
+              f"({totals['duplicates']} duplicates, {totals['rejected']} rejected)")
+
+def export_transactions(username, output=None):
+    """Write a user's transactions as CSV in a format the import command reads back"""
+    with app.app_context():
+        data = find_user_data(username)
+        out = open(output, 'w', newline='') if output else sys.stdout
+        try:
+            writer = csv.writer(out)
+            writer.writerow(EXPORT_HEADER)
+            count = 0
+            for row in export_rows(data.id):
+                writer.writerow(csv_row(row))
+                count += 1
+                if count % EXPORT_PROGRESS_ROWS == 0:
+                    print(f"{count:,} transactions exported", file=sys.stderr)
+        finally:
+            if output:
+                out.close()
+        print(f"Exported {count} transactions", file=sys.stderr)
+
 if __name__ == "__main__":
-    if len(sys.argv) > 1:
-        if sys.argv[1] == "reset_db":
-            reset_db()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='DivTrack database management')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('reset_db', help='drop and recreate all tables')
+    commands.add_parser('migrate', help='bring an existing database up to the current schema')
+    
+    import_parser = commands.add_parser('import', help="import CSV files or ZIP archives into a user's data")
+    import_parser.add_argument('user', help='username')
+    import_parser.add_argument('files', nargs='+')
+    import_parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_ROWS, help='CSV rows per commit')
+    import_parser.add_argument('--checkpoint', help='progress file used to resume (default .divtrack-import-<user>.json)')
+    
+    export_parser = commands.add_parser('export', help="export a user's transactions as CSV")
+    export_parser.add_argument('user', help='username')
+    export_parser.add_argument('--output', '-o', help='file to write instead of stdout')
+    
+    args = parser.parse_args()
+    if args.command == "reset_db":
+        reset_db()
+    elif args.command == "migrate":
+        migrate()
+    elif args.command == "import":
+        import_files(args.user, args.files, args.batch_size, args.checkpoint)
+    elif args.command == "export":
+        export_transactions(args.user, args.output)
@@ -0,0 +1,190 @@
+import time
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+from flask import g, request, has_request_context, before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Upper bounds, in seconds, of the histogram buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+METRIC_PREFIX = 'divtrack_'
+
+METRIC_HELP = {
+    'requests_total': 'Requests handled, by endpoint, method and status',
+    'request_duration_seconds': 'Time spent handling a request',
+    'db_queries_total': 'SQL statements executed while handling requests',
+    'db_query_seconds_total': 'Time spent executing SQL statements while handling requests',
+    'render_seconds_total': 'Time spent rendering templates',
+    'ingest_stage_seconds': 'Time spent in each stage of CSV ingest',
+    'ingest_jobs_total': 'Finished ingest jobs, by status'
+}
+
+
+def _format_labels(labels):
+    """Render (name, value) pairs as a Prometheus label set"""
+    if not labels:
+        return ''
+    pairs = []
+    for name, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+class Metrics:
+    """In-process request, SQL and ingest metrics exposed in the Prometheus text format
+
+    Recording a value is a dict update under a lock, so the hooks are cheap
+    enough to leave on. Each worker process keeps its own figures.
+    """
+
+    def __init__(self, app=None, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.enabled = False
+        self.server_timing = False
+        self._counters = defaultdict(float)
+        # (name, labels) -> [per-bucket counts..., +Inf count], sum
+        self._histograms = {}
+        self._types = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('METRICS_ENABLED', True)
+        self.server_timing = app.config.get('SERVER_TIMING', False)
+        if not self.enabled:
+            return
+
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+        before_render_template.connect(self._start_render, app)
+        template_rendered.connect(self._finish_render, app)
+        # Listening on the Engine class covers engines Flask-SQLAlchemy creates later
+        if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+    def inc(self, name, labels=(), amount=1):
+        """Add to a counter; labels is a tuple of (name, value) pairs"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._types.setdefault(name, 'counter')
+            self._counters[(name, labels)] += amount
+
+    def observe(self, name, value, labels=()):
+        """Record one value in a histogram"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._types.setdefault(name, 'histogram')
+            histogram = self._histograms.get((name, labels))
+            if histogram is None:
+                histogram = self._histograms[(name, labels)] = [[0] * (len(self.buckets) + 1), 0.0]
+            histogram[0][bisect_left(self.buckets, value)] += 1
+            histogram[1] += value
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Observe how long the body takes in the named histogram"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, tuple(sorted(labels.items())))
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, (list(counts), total)) for key, (counts, total) in self._histograms.items())
+            types = dict(self._types)
+
+        lines = []
+        described = set()
+
+        def describe(name):
+            if name not in described:
+                described.add(name)
+                if name in METRIC_HELP:
+                    lines.append(f"# HELP {METRIC_PREFIX}{name} {METRIC_HELP[name]}")
+                lines.append(f"# TYPE {METRIC_PREFIX}{name} {types[name]}")
+
+        for (name, labels), value in counters:
+            describe(name)
+            lines.append(f"{METRIC_PREFIX}{name}{_format_labels(labels)} {value:g}")
+
+        for (name, labels), (counts, total) in histograms:
+            describe(name)
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append(f"{METRIC_PREFIX}{name}_bucket{_format_labels(labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{METRIC_PREFIX}{name}_sum{_format_labels(labels)} {total:g}")
+            lines.append(f"{METRIC_PREFIX}{name}_count{_format_labels(labels)} {cumulative}")
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+            self._types.clear()
+
+    def _start_request(self):
+        g.request_timing = {'start': time.perf_counter(), 'queries': 0, 'query_seconds': 0.0, 'render_seconds': 0.0}
+
+    def _finish_request(self, response):
+        timing = g.pop('request_timing', None)
+        if timing is None:
+            return response
+
+        duration = time.perf_counter() - timing['start']
+        endpoint = request.url_rule.endpoint if request.url_rule else 'unmatched'
+        route = (('endpoint', endpoint),)
+        self.inc('requests_total', route + (('method', request.method), ('status', response.status_code)))
+        self.observe('request_duration_seconds', duration, route + (('method', request.method),))
+        if timing['queries']:
+            self.inc('db_queries_total', route, timing['queries'])
+            self.inc('db_query_seconds_total', route, timing['query_seconds'])
+        if timing['render_seconds']:
+            self.inc('render_seconds_total', route, timing['render_seconds'])
+
+        if self.server_timing:
+            response.headers['Server-Timing'] = (
+                f'app;dur={duration * 1000:.1f}, '
+                f'db;dur={timing["query_seconds"] * 1000:.1f};desc="{timing["queries"]} queries", '
+                f'render;dur={timing["render_seconds"] * 1000:.1f}'
+            )
+        return response
+
+    def _start_render(self, sender, template, context, **extra):
+        timing = g.get('request_timing')
+        if timing is not None:
+            timing['render_start'] = time.perf_counter()
+
+    def _finish_render(self, sender, template, context, **extra):
+        timing = g.get('request_timing')
+        if timing is not None and 'render_start' in timing:
+            timing['render_seconds'] += time.perf_counter() - timing.pop('render_start')
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # Statements from background ingest workers have no request to charge them to
+    if has_request_context() and conn.info.get('query_start'):
+        timing = g.get('request_timing')
+        elapsed = time.perf_counter() - conn.info['query_start'].pop()
+        if timing is not None:
+            timing['queries'] += 1
+            timing['query_seconds'] += elapsed
+
+
+metrics = Metrics()
@@ -2,9 +2,57 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
+import numpy as np
 
 db = SQLAlchemy()
 
+# Maximum stored length of a ticker symbol
+SYMBOL_LENGTH = 20
+
+# Decimal places of a cent kept before rounding, enough to drop float noise in amount * 100
+CENT_PRECISION = 6
+
+def amounts_to_cents(amounts):
+    """Convert dollar amounts to an int64 array of cents, rounding half away from zero
+
+    This is the one rounding rule for money. amount * 100 is first rounded to
+    CENT_PRECISION places, so 1.005 * 100 == 100.49999999999999 still rounds
+    to 101 cents, as the decimal value would.
+    """
+    scaled = np.round(np.asarray(amounts, dtype='float64') * 100, CENT_PRECISION)
+    return (np.sign(scaled) * np.floor(np.abs(scaled) + 0.5)).astype('int64')
+
+def to_cents(amount):
+    """Convert a dollar amount to a whole number of cents, rounding like amounts_to_cents"""
+    if amount is None:
+        return None
+    return int(amounts_to_cents([float(amount)])[0])
+
+def from_cents(cents):
+    """Convert a whole number of cents to a dollar amount for display"""
+    if cents is None:
+        return None
+    return cents / 100
+
+class Cents(db.TypeDecorator):
+    """Money stored exactly as an integer number of cents"""
+    impl = db.BigInteger
+    cache_ok = True
+    
+    def process_result_value(self, value, dialect):
+        # SQLite databases migrated from Float columns may hand back 1234.0
+        return int(value) if value is not None else None
+
+def money_property(cents_attribute):
+    """Dollar view of a cents column, converting on assignment"""
+    def getter(self):
+        return from_cents(getattr(self, cents_attribute))
+    
+    def setter(self, amount):
+        setattr(self, cents_attribute, to_cents(amount))
+    
+    return property(getter, setter)
+
 class User(UserMixin, db.Model):
     """User model for authentication"""
     id = db.Column(db.Integer, primary_key=True)
@@ -26,31 +74,52 @@ class User(UserMixin, db.Model):
     def __repr__(self):
         return f'<User {self.username}>'
 
+class Principal(UserMixin):
+    """Logged-in user as cached between requests, without an ORM instance"""
+    
+    def __init__(self, id, username, dividend_data_id):
+        self.id = id
+        self.username = username
+        self.dividend_data_id = dividend_data_id
+    
+    def __repr__(self):
+        return f'<Principal {self.username}>'
+
 class DividendData(db.Model):
     """User's dividend tracking data"""
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    initial_investment = db.Column(db.Float, default=0.0)
-    total_dividends = db.Column(db.Float, default=0.0)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    initial_investment_cents = db.Column('initial_investment', Cents, default=0)
+    total_dividends_cents = db.Column('total_dividends', Cents, default=0)
     principal_recovered = db.Column(db.Boolean, default=False)
     recovery_date = db.Column(db.DateTime)
-    post_recovery_gains = db.Column(db.Float, default=0.0)
+    post_recovery_gains_cents = db.Column('post_recovery_gains', Cents, default=0)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    initial_investment = money_property('initial_investment_cents')
+    total_dividends = money_property('total_dividends_cents')
+    post_recovery_gains = money_property('post_recovery_gains_cents')
+    
     # Relationship to transactions
     transactions = db.relationship('DividendTransaction', backref='dividend_data', lazy=True, cascade='all, delete-orphan')
     monthly_totals = db.relationship('MonthlyTotal', backref='dividend_data', lazy=True, cascade='all, delete-orphan')
+    symbol_totals = db.relationship('SymbolTotal', backref='dividend_data', lazy=True, cascade='all, delete-orphan')
+    # Eager loaded by get_or_create_user_data only on pages that render from it (SUMMARY_ENDPOINTS)
+    summary = db.relationship('DashboardSummary', backref='dividend_data', lazy=True, uselist=False, cascade='all, delete-orphan')
     
     def to_dict(self):
-        """Convert to dictionary for JSON serialization"""
+        """Convert to dictionary for JSON serialization
+
+        Transactions are left out; /api/export.csv and /api/export.ndjson
+        stream them without loading the whole history.
+        """
         return {
             'initial_investment': self.initial_investment,
             'total_dividends': self.total_dividends,
             'principal_recovered': self.principal_recovered,
             'recovery_date': self.recovery_date.strftime('%Y-%m-%d') if self.recovery_date else None,
             'post_recovery_gains': self.post_recovery_gains,
-            'transactions': [t.to_dict() for t in self.transactions],
             'monthly_totals': {mt.month: mt.amount for mt in self.monthly_totals}
         }
     
@@ -62,14 +131,28 @@ class DividendTransaction(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     dividend_data_id = db.Column(db.Integer, db.ForeignKey('dividend_data.id'), nullable=False)
     date = db.Column(db.Date, nullable=False)
+    symbol = db.Column(db.String(SYMBOL_LENGTH))
     description = db.Column(db.String(200), nullable=False)
-    amount = db.Column(db.Float, nullable=False)
+    amount_cents = db.Column('amount', Cents, nullable=False)
     upload_date = db.Column(db.DateTime, default=datetime.utcnow)
+    fingerprint = db.Column(db.String(64))  # Content hash used to skip re-uploaded rows
+    
+    amount = money_property('amount_cents')
+    
+    __table_args__ = (
+        # Ensure each transaction is stored once per user
+        db.Index('ix_transaction_fingerprint', 'dividend_data_id', 'fingerprint', unique=True),
+        # Keyset pagination over a user's history, optionally for one symbol
+        db.Index('ix_transaction_data_date_id', 'dividend_data_id', 'date', 'id'),
+        db.Index('ix_transaction_data_symbol_date_id', 'dividend_data_id', 'symbol', 'date', 'id'),
+    )
     
     def to_dict(self):
         """Convert to dictionary for JSON serialization"""
         return {
+            'id': self.id,
             'date': self.date.strftime('%Y-%m-%d'),
+            'symbol': self.symbol,
             'description': self.description,
             'amount': self.amount,
             'upload_date': self.upload_date.strftime('%Y-%m-%d %H:%M:%S')
@@ -83,10 +166,92 @@ class MonthlyTotal(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     dividend_data_id = db.Column(db.Integer, db.ForeignKey('dividend_data.id'), nullable=False)
     month = db.Column(db.String(7), nullable=False)  # Format: YYYY-MM
-    amount = db.Column(db.Float, default=0.0)
+    amount_cents = db.Column('amount', Cents, default=0)
+    
+    amount = money_property('amount_cents')
     
     # Ensure unique month per user
     __table_args__ = (db.UniqueConstraint('dividend_data_id', 'month', name='unique_month_per_user'),)
     
     def __repr__(self):
         return f'<MonthlyTotal {self.month}: ${self.amount}>'
+
+class SymbolTotal(db.Model):
+    """Dividend totals per symbol and month"""
+    id = db.Column(db.Integer, primary_key=True)
+    dividend_data_id = db.Column(db.Integer, db.ForeignKey('dividend_data.id'), nullable=False)
+    symbol = db.Column(db.String(SYMBOL_LENGTH), nullable=False)
+    month = db.Column(db.String(7), nullable=False)  # Format: YYYY-MM
+    amount_cents = db.Column('amount', Cents, default=0)
+    
+    amount = money_property('amount_cents')
+    
+    # Ensure unique symbol and month per user
+    __table_args__ = (db.UniqueConstraint('dividend_data_id', 'symbol', 'month', name='unique_symbol_month_per_user'),)
+    
+    def __repr__(self):
+        return f'<SymbolTotal {self.symbol} {self.month}: ${self.amount}>'
+
+class DashboardSummary(db.Model):
+    """Precomputed dashboard figures, maintained incrementally"""
+    id = db.Column(db.Integer, primary_key=True)
+    dividend_data_id = db.Column(db.Integer, db.ForeignKey('dividend_data.id'), nullable=False, unique=True)
+    monthly_series = db.Column(db.JSON, default=list)  # [{'month': 'YYYY-MM', 'amount_cents': ...}] sorted by month
+    transaction_count = db.Column(db.Integer, default=0)
+    recent_transactions = db.Column(db.JSON, default=list)  # Latest transactions, oldest first
+    progress_percentage = db.Column(db.Float, default=0.0)
+    symbol_totals = db.Column(db.JSON)  # {symbol: amount in cents} across all months
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<DashboardSummary for DividendData {self.dividend_data_id}>'
+
+class IngestJob(db.Model):
+    """Background CSV ingest job and its progress"""
+    id = db.Column(db.String(32), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    dividend_data_id = db.Column(db.Integer, db.ForeignKey('dividend_data.id'), nullable=False)
+    filename = db.Column(db.String(255))
+    status = db.Column(db.String(20), default='queued')  # queued, running, completed, failed
+    stage = db.Column(db.String(20))  # parsing, saving
+    rows_read = db.Column(db.Integer, default=0)
+    transactions_found = db.Column(db.Integer, default=0)
+    inserted = db.Column(db.Integer, default=0)
+    duplicates = db.Column(db.Integer, default=0)
+    rejected = db.Column(db.Integer, default=0)
+    total_added_cents = db.Column('total_added', Cents, default=0)
+    error = db.Column(db.Text)
+    # Results for each CSV in the upload: filename, rows_read, transactions_found,
+    # inserted, duplicates, rejected and error
+    files = db.Column(db.JSON)
+    notified = db.Column(db.Boolean, default=False)  # Result shown to the user on the dashboard
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    
+    total_added = money_property('total_added_cents')
+    
+    # Jobs the dashboard has not reported yet, oldest first
+    __table_args__ = (db.Index('ix_ingest_job_data_notified_created', 'dividend_data_id', 'notified', 'created_at'),)
+    
+    def to_dict(self):
+        """Convert to dictionary for JSON serialization"""
+        return {
+            'id': self.id,
+            'filename': self.filename,
+            'status': self.status,
+            'stage': self.stage,
+            'rows_read': self.rows_read,
+            'transactions_found': self.transactions_found,
+            'inserted': self.inserted,
+            'duplicates': self.duplicates,
+            'rejected': self.rejected,
+            'total_added': self.total_added,
+            'error': self.error,
+            'files': self.files or [],
+            'created_at': self.created_at.strftime('%Y-%m-%d %H:%M:%S') if self.created_at else None,
+            'finished_at': self.finished_at.strftime('%Y-%m-%d %H:%M:%S') if self.finished_at else None
+        }
+    
+    def __repr__(self):
+        return f'<IngestJob {self.id} {self.status}>'
@@ -0,0 +1,122 @@
+import math
+from datetime import date, datetime
+import numpy as np
+import pandas as pd
+from sqlalchemy import select
+from models import db, DividendTransaction, from_cents
+
+# Months of dividends averaged when projecting the recovery date
+TRAILING_MONTHS = 12
+
+
+def accumulate(series, start=0):
+    """Fill in cumulative_cents on monthly series entries from index start onward
+
+    Entries before start keep their running totals, so folding in an upload
+    only recomputes the months from the earliest one it touched.
+    """
+    amounts = np.array([entry['amount_cents'] for entry in series[start:]], dtype=np.int64)
+    base = series[start - 1]['cumulative_cents'] if start else 0
+    for entry, cumulative in zip(series[start:], (base + np.cumsum(amounts)).tolist()):
+        entry['cumulative_cents'] = cumulative
+    return series
+
+
+def recovery_index(series, target_cents):
+    """Position of the first month whose running total reached target_cents, or None"""
+    if not series:
+        return None
+    # Reversals can make the running total dip, so search the running maximum, which never decreases
+    reached = np.maximum.accumulate(np.array([entry['cumulative_cents'] for entry in series], dtype=np.int64))
+    index = int(np.searchsorted(reached, target_cents, side='left'))
+    return index if index < len(series) else None
+
+
+def recovery_day(dividend_data_id, month, cents_before, target_cents):
+    """Date of the transaction that carried the running total to target_cents within a month"""
+    start = datetime.strptime(month, '%Y-%m').date()
+    end = date(start.year + start.month // 12, start.month % 12 + 1, 1)
+    rows = db.session.execute(
+        select(DividendTransaction.date, DividendTransaction.amount_cents)
+        .where(DividendTransaction.dividend_data_id == dividend_data_id,
+               DividendTransaction.date >= start, DividendTransaction.date < end)
+        .order_by(DividendTransaction.date, DividendTransaction.id)
+    ).all()
+    if not rows:
+        return start
+
+    running = cents_before + np.maximum.accumulate(np.cumsum([amount_cents for _, amount_cents in rows]))
+    index = min(int(np.searchsorted(running, target_cents, side='left')), len(rows) - 1)
+    return rows[index][0]
+
+
+def update_recovery(data):
+    """Set the principal recovery fields from the summary's cumulative timeline
+
+    The recovery date is when the running total of dividends first reached
+    the initial investment: the month is found by a binary search of the
+    timeline, then the day from that month's transactions alone.
+    """
+    series = data.summary.monthly_series
+    target_cents = data.initial_investment_cents or 0
+    gains_cents = (data.total_dividends_cents or 0) - target_cents
+
+    data.principal_recovered = gains_cents >= 0
+    data.post_recovery_gains_cents = gains_cents if data.principal_recovered else 0
+    index = recovery_index(series, target_cents) if data.principal_recovered and target_cents > 0 else None
+    if index is None:
+        data.recovery_date = None
+        return
+
+    cents_before = series[index - 1]['cumulative_cents'] if index else 0
+    day = recovery_day(data.id, series[index]['month'], cents_before, target_cents)
+    data.recovery_date = datetime.combine(day, datetime.min.time())
+
+
+def trailing_average(series, months=TRAILING_MONTHS):
+    """Average monthly dividends in cents over the last months of the timeline
+
+    Months without dividends count as zero. Histories shorter than the
+    window are averaged over the months they span.
+    """
+    if not series:
+        return 0
+    periods = pd.PeriodIndex([entry['month'] for entry in series], freq='M')
+    amounts = np.array([entry['amount_cents'] for entry in series], dtype=np.int64)
+    last = periods[-1]
+    in_window = periods > last - months
+    span = min(months, (last - periods[0]).n + 1)
+    return int(amounts[in_window].sum()) / span
+
+
+def projected_recovery(data, months=TRAILING_MONTHS):
+    """Month the initial investment is expected to be recovered at the trailing pace of dividends
+
+    Returns a dict with the projected month ('YYYY-MM', or None when it
+    cannot be projected), the months remaining from the latest month with
+    dividends and the trailing monthly average in dollars.
+    """
+    series = data.summary.monthly_series
+    average = trailing_average(series, months)
+    remaining_cents = (data.initial_investment_cents or 0) - (data.total_dividends_cents or 0)
+    projection = {'month': None, 'months_remaining': None, 'trailing_monthly_average': from_cents(round(average))}
+    if data.principal_recovered or remaining_cents <= 0 or average <= 0:
+        return projection
+
+    months_remaining = math.ceil(remaining_cents / average)
+    projection['month'] = str(pd.Period(series[-1]['month'], freq='M') + months_remaining)
+    projection['months_remaining'] = months_remaining
+    return projection
+
+
+def recovery_timeline(data):
+    """Recovery status, projection and the cumulative dividends of every month, in dollars"""
+    return {
+        'initial_investment': data.initial_investment,
+        'principal_recovered': data.principal_recovered,
+        'recovery_date': data.recovery_date.strftime('%Y-%m-%d') if data.recovery_date else None,
+        'projection': projected_recovery(data),
+        'timeline': [{'month': entry['month'], 'amount': from_cents(entry['amount_cents']),
+                      'cumulative': from_cents(entry['cumulative_cents'])}
+                     for entry in data.summary.monthly_series]
+    }
@@ -0,0 +1,124 @@
+from sqlalchemy import select, func
+from models import db, DashboardSummary, DividendTransaction, MonthlyTotal, SymbolTotal
+from recovery import accumulate, update_recovery
+
+# Number of transactions shown in the dashboard's recent list
+RECENT_TRANSACTIONS = 5
+
+
+def progress_percentage(data):
+    """Share of the initial investment recovered through dividends, capped at 100"""
+    if data.initial_investment_cents > 0:
+        return min(100, (data.total_dividends_cents / data.initial_investment_cents) * 100)
+    return 0
+
+
+def transaction_entry(date, description, amount_cents):
+    """Summary representation of a single transaction"""
+    return {'date': date.strftime('%Y-%m-%d'), 'description': description, 'amount_cents': amount_cents}
+
+
+def rebuild_summary(data):
+    """Recompute the summary from the stored monthly totals and transactions"""
+    summary = data.summary
+    if summary is None:
+        summary = data.summary = DashboardSummary()
+
+    monthly = db.session.execute(
+        select(MonthlyTotal.month, MonthlyTotal.amount_cents)
+        .where(MonthlyTotal.dividend_data_id == data.id)
+        .order_by(MonthlyTotal.month)
+    ).all()
+    summary.monthly_series = accumulate([{'month': month, 'amount_cents': amount_cents} for month, amount_cents in monthly])
+
+    summary.transaction_count = db.session.scalar(
+        select(func.count()).select_from(DividendTransaction)
+        .where(DividendTransaction.dividend_data_id == data.id)
+    )
+    recent = db.session.execute(
+        select(DividendTransaction.date, DividendTransaction.description, DividendTransaction.amount_cents)
+        .where(DividendTransaction.dividend_data_id == data.id)
+        .order_by(DividendTransaction.id.desc())
+        .limit(RECENT_TRANSACTIONS)
+    ).all()
+    summary.recent_transactions = [transaction_entry(*row) for row in reversed(recent)]
+    summary.progress_percentage = progress_percentage(data)
+
+    symbol_totals = db.session.execute(
+        select(SymbolTotal.symbol, func.sum(SymbolTotal.amount_cents))
+        .where(SymbolTotal.dividend_data_id == data.id)
+        .group_by(SymbolTotal.symbol)
+    ).all()
+    summary.symbol_totals = {symbol: amount_cents for symbol, amount_cents in symbol_totals}
+    return summary
+
+
+def is_stale(summary):
+    """Whether a summary predates per-symbol totals or the cumulative timeline"""
+    return (summary is None or summary.symbol_totals is None
+            or any('cumulative_cents' not in entry for entry in summary.monthly_series[-1:]))
+
+
+def get_summary(data):
+    """Return the user's dashboard summary, building it the first time it is needed"""
+    # Older summaries are rebuilt once, and the recovery date, which used to be the
+    # time of the upload, is corrected from the new timeline
+    if is_stale(data.summary):
+        rebuild_summary(data)
+        update_recovery(data)
+        db.session.commit()
+    return data.summary
+
+
+def apply_ingest(data, changes):
+    """Fold newly inserted transactions into the summary
+
+    changes holds monthly_amounts ('YYYY-MM' to cents added), symbol_amounts
+    (symbol to cents added), inserted (number of new transactions) and latest
+    (entries for the most recent new transactions, in insertion order).
+    """
+    summary = data.summary
+    if is_stale(summary):
+        # The new rows are already flushed, so a rebuild includes them
+        rebuild_summary(data)
+        return
+
+    # Running totals before the earliest month touched are unchanged and kept
+    previous = summary.monthly_series
+    series = {entry['month']: entry['amount_cents'] for entry in previous}
+    for month, amount_cents in changes['monthly_amounts'].items():
+        series[month] = series.get(month, 0) + amount_cents
+    months = sorted(series)
+    start = months.index(min(changes['monthly_amounts'])) if changes['monthly_amounts'] else len(months)
+    summary.monthly_series = accumulate(
+        previous[:start] + [{'month': month, 'amount_cents': series[month]} for month in months[start:]], start
+    )
+
+    symbol_totals = dict(summary.symbol_totals)
+    for symbol, amount_cents in changes['symbol_amounts'].items():
+        symbol_totals[symbol] = symbol_totals.get(symbol, 0) + amount_cents
+    summary.symbol_totals = symbol_totals
+
+    summary.transaction_count += changes['inserted']
+    summary.recent_transactions = (summary.recent_transactions + changes['latest'])[-RECENT_TRANSACTIONS:]
+    summary.progress_percentage = progress_percentage(data)
+
+
+def refresh_progress(data):
+    """Update the summary after the initial investment or totals change"""
+    if is_stale(data.summary):
+        rebuild_summary(data)
+    else:
+        data.summary.progress_percentage = progress_percentage(data)
+
+
+def clear_summary(data):
+    """Empty the summary after the user's data is reset"""
+    summary = data.summary
+    if summary is None:
+        summary = data.summary = DashboardSummary()
+    summary.monthly_series = []
+    summary.transaction_count = 0
+    summary.recent_transactions = []
+    summary.progress_percentage = 0
+    summary.symbol_totals = {}
@@ -0,0 +1,197 @@
+import csv
+from io import BytesIO, StringIO
+import numpy as np
+import pandas as pd
+import pytest
+import bench
+from models import from_cents, to_cents
+from ingest import iter_records, parse_broker_csv
+
+ROBINHOOD_HEADER = ','.join(bench.HEADER)
+
+# Robinhood rows covering the cases the parser must treat like the original one
+ROBINHOOD_ROWS = [
+    '8/1/2025,8/1/2025,8/1/2025,MSTY,Cash Div: R/D 2025-07-31,CDIV,,,$12.34',
+    '8/1/2025,8/1/2025,8/1/2025,JEPQ,"Cash Div, JEPQ",CDIV,,,"$1,234.56"',
+    '8/2/2025,8/2/2025,8/2/2025,SCHD,Qualified Dividend,QDIV,,,$7',
+    '8/2/2025,8/2/2025,8/2/2025,,Capital Gain Distribution,CDIV,,,$3.10',
+    '8/3/2025,8/3/2025,8/3/2025,O,Cash Div,CDIV,,,($5.00)',
+    '8/3/2025,8/3/2025,8/3/2025,O,Cash Div,CDIV,,,--',
+    '8/3/2025,8/3/2025,8/3/2025,O,Cash Div,CDIV,,,1e1',
+    'N/A,8/4/2025,8/4/2025,QYLD,Cash Div,CDIV,,,$0.17',
+    '8/4/2025,8/4/2025,8/4/2025,QYLD,Cash Div,CDIV,,,$0.00',
+    '8/5/2025,8/5/2025,8/5/2025,MSTY,Cash Div, MSTY, special,CDIV,100,$0.50,$50.00',
+    '8/5/2025,8/5/2025,8/5/2025,MSTY,Cash Div',
+    '8/5/2025,8/5/2025,8/5/2025,MSTY,MSTY Option Income Strategy ETF,Buy,10,$20.00,($200.00)',
+    '8/6/2025,8/6/2025,8/6/2025,,Interest Payment,INT,,,$0.42',
+    '8/6/2025,8/6/2025,8/6/2025,NVDY,DIVIDEND,CDIV,,,  $8.80  ',
+]
+
+# Generic export whose amounts are all whole numbers, so pandas would infer integers
+WHOLE_AMOUNT_ROWS = [
+    'Date,Description,Amount,Symbol',
+    '2025-08-01,Dividend,10,MSTY',
+    '2025-08-02,Dividend,25,JEPI',
+    '2025-08-03,Transfer,100,',
+    '2025-08-04,Distribution,3,',
+]
+
+# Generic export with more than nine columns; the original parser only looked at the first nine
+WIDE_ROWS = [
+    'Date,Details,Net Amount,Security,A,B,C,D,E,F,G',
+    '08-01-25,Dividend received,$4.50,ULTY,,,,,,,',
+    '08-02-25,Dividend received,$4.60,ULTY,,,,,,,,extra',
+    '08-03-25,Dividend received,$4.70,ULTY,,,,,,,',
+]
+
+
+def baseline_parse(source):
+    """The per-row parser the vectorized engine replaced, kept as the reference for its output"""
+    df = pd.read_csv(source, on_bad_lines='skip')
+    if len(df.columns) > 9:
+        df = df.iloc[:, :9]
+
+    date_col = next((col for col in ['Date', 'date', 'Date/Time', 'date/time', 'Activity Date', 'Process Date',
+                                     'Settle Date'] if col in df.columns), None)
+    desc_col = next((col for col in ['Description', 'description', 'Details', 'details'] if col in df.columns), None)
+    amount_col = next((col for col in ['Amount', 'amount', 'Net Amount', 'net amount'] if col in df.columns), None)
+    instrument_col = next((col for col in ['Instrument', 'instrument', 'Symbol', 'symbol', 'Security', 'security']
+                           if col in df.columns), None)
+
+    transactions = []
+    for _, row in df.iterrows():
+        description = str(row[desc_col]).lower()
+        amount = row[amount_col]
+        if any(keyword in description for keyword in ['dividend', 'div', 'distribution']):
+            try:
+                if isinstance(amount, str):
+                    amount = float(amount.replace('$', '').replace(',', '').strip())
+                else:
+                    amount = float(amount)
+            except (ValueError, TypeError):
+                continue
+            if amount > 0:
+                symbol = str(row[instrument_col]) if instrument_col and instrument_col in row else "Unknown"
+                transactions.append({
+                    'date': str(row[date_col]),
+                    # Described by the stored cents, which round half away from zero
+                    'description': f"{symbol} Dividend - ${from_cents(to_cents(amount)):.2f}",
+                    'amount': amount
+                })
+    return transactions
+
+
+def comparable(transactions):
+    """The fields both parsers return, with the amount's type so ints are not mistaken for floats"""
+    return [(t['date'], t['description'], t['amount'], type(t['amount'])) for t in transactions]
+
+
+def to_csv(rows, header=bench.HEADER):
+    """Encode rows as an upload with the given header"""
+    output = StringIO()
+    writer = csv.writer(output)
+    writer.writerow(header)
+    writer.writerows(rows)
+    return BytesIO(output.getvalue().encode('utf-8'))
+
+
+@pytest.mark.parametrize('chunksize', [1, 2, 50000])
+def test_row_with_extra_fields_is_skipped(chunksize):
+    # Unquoted commas in the description push Quantity into the Amount position;
+    # pandas' own chunked reader keeps such rows when they start a chunk
+    upload = BytesIO('\n'.join([
+        ROBINHOOD_HEADER,
+        '8/1/2025,8/1/2025,8/1/2025,MSTY,Cash Div,CDIV,,,$5.00',
+        '8/1/2025,8/1/2025,8/1/2025,MSTY,Cash Div, MSTY, special,CDIV,100,$0.50,$50.00',
+        '8/2/2025,8/2/2025,8/2/2025,MSTY,Cash Div,CDIV,,,$6.00',
+    ]).encode('utf-8'))
+
+    transactions = parse_broker_csv(upload, chunksize=chunksize)
+
+    assert [transaction['amount'] for transaction in transactions] == [5.0, 6.0]
+
+
+@pytest.mark.parametrize('chunksize', [1, 50000])
+def test_literal_quote_inside_field_does_not_join_records(chunksize):
+    # A quote that does not start a field is literal, so it must not open a quoted section
+    lines = [
+        'Date,Description,Amount,Symbol',
+        '2025-08-01,Dividend 5" x,1.00,MSTY',
+        '2025-08-02,Dividend,2.00,JEPI',
+        '2025-08-03,"Dividend, ""special""",3.00,ULTY',
+        '2025-08-04,Dividend,4.00,SCHD',
+    ]
+    content = '\n'.join(lines)
+
+    assert list(iter_records(StringIO(content, newline=''))) == [line + '\n' for line in lines[:-1]] + lines[-1:]
+    transactions = parse_broker_csv(BytesIO(content.encode('utf-8')), chunksize=chunksize)
+    assert comparable(transactions) == comparable(baseline_parse(BytesIO(content.encode('utf-8'))))
+    assert [t['amount'] for t in transactions] == [1.0, 2.0, 3.0, 4.0]
+
+
+def test_description_matches_stored_cents():
+    # 5.005 is just below the half cent as a float, yet is stored as 501 cents
+    content = b'Date,Description,Amount,Symbol\n2025-08-01,Dividend,5.005,MSTY\n2025-08-02,Dividend,0.125,JEPI\n'
+
+    transactions = parse_broker_csv(BytesIO(content))
+
+    assert [(t['amount_cents'], t['description']) for t in transactions] == [
+        (501, 'MSTY Dividend - $5.01'),
+        (13, 'JEPI Dividend - $0.13'),
+    ]
+
+
+def test_bench_padded_rows_are_skipped():
+    rows = bench.generate_chunk(np.random.default_rng(0), 20000)
+    padded = [row for row in rows if len(row) > len(bench.HEADER)]
+    assert padded
+
+    with_padding = parse_broker_csv(to_csv(rows), chunksize=4096)
+    without_padding = parse_broker_csv(to_csv([row for row in rows if len(row) <= len(bench.HEADER)]),
+                                       chunksize=4096)
+
+    assert [(t['date'], t['amount']) for t in with_padding] == \
+        [(t['date'], t['amount']) for t in without_padding]
+
+
+@pytest.mark.parametrize('lines', [[ROBINHOOD_HEADER] + ROBINHOOD_ROWS, WHOLE_AMOUNT_ROWS, WIDE_ROWS],
+                         ids=['robinhood', 'whole-amounts', 'wide'])
+@pytest.mark.parametrize('chunksize', [1, 3, 50000])
+def test_matches_baseline_parser(lines, chunksize):
+    content = '\n'.join(lines).encode('utf-8')
+
+    transactions = parse_broker_csv(BytesIO(content), chunksize=chunksize)
+
+    assert comparable(transactions) == comparable(baseline_parse(BytesIO(content)))
+    assert all(type(t['amount']) is float for t in transactions)
+
+
+@pytest.mark.parametrize('chunksize', [997, 50000])
+def test_matches_baseline_parser_on_bench_export(chunksize):
+    # Mixed date styles plus truncated, padded and garbage rows across many chunks
+    rows = bench.generate_chunk(np.random.default_rng(1), 5000)
+    content = to_csv(rows).getvalue()
+
+    transactions = parse_broker_csv(BytesIO(content), chunksize=chunksize)
+
+    assert comparable(transactions) == comparable(baseline_parse(BytesIO(content)))
+
+
+@pytest.mark.parametrize('lines', [WHOLE_AMOUNT_ROWS, [
+    'Run Date,Action,Symbol,Amount ($)',
+    '08/01/2025,DIVIDEND RECEIVED MSTY,MSTY,12.34',
+    '08/02/2025,YOU BOUGHT MSTY,MSTY,-200.00',
+]], ids=['generic', 'fidelity'])
+def test_blank_lines_before_header_are_skipped(lines):
+    content = '\n\n \r\n' + '\n'.join(lines)
+
+    transactions = parse_broker_csv(BytesIO(content.encode('utf-8')))
+
+    assert [t['amount'] for t in transactions] == [t['amount'] for t in parse_broker_csv(BytesIO(
+        '\n'.join(lines).encode('utf-8')))]
+    assert transactions
+
+
+def test_unrecognized_header_is_rejected():
+    with pytest.raises(ValueError, match='Could not identify required columns'):
+        parse_broker_csv(BytesIO(b'When,What,How much\n2025-08-01,Dividend,1.00\n'))
@@ -0,0 +1,25 @@
+import pytest
+from models import amounts_to_cents, to_cents
+
+# (dollars, cents) pairs on and around half-cent boundaries
+ROUNDING_CASES = [
+    (0.125, 13),
+    (0.135, 14),
+    (1.005, 101),
+    (2.675, 268),
+    (0.124999, 12),
+    (1234.56, 123456),
+    (-0.125, -13),
+    (0, 0),
+]
+
+
+@pytest.mark.parametrize('amount, cents', ROUNDING_CASES)
+def test_to_cents_rounds_half_away_from_zero(amount, cents):
+    assert to_cents(amount) == cents
+
+
+def test_parser_and_model_conversions_agree():
+    amounts = [amount for amount, _ in ROUNDING_CASES]
+
+    assert amounts_to_cents(amounts).tolist() == [to_cents(amount) for amount in amounts]